@@ -0,0 +1,285 @@
+"""
+Benchmarks of the memoizer hot paths and cache backends.
+
+    python benchmarks/run.py                                  # run all, print seconds per operation
+    python benchmarks/run.py --output results.json            # also write them as json
+    python benchmarks/run.py --baseline benchmarks/baseline.json --threshold 2
+
+With --baseline, every benchmark slower than `threshold` times its baseline is reported as a
+regression and the exit code is 1, as it is for a benchmark missing from the baseline, which
+could not be checked. Benchmarks dominated by disk writes, which are noisy, declare a larger
+threshold of their own. Timings are the best of --repeat runs, to filter out noise.
+Benchmarks needing pandas are skipped when it is not installed. Timings depend on the machine,
+so refresh the baseline with --output where the comparison runs.
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import timeit
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from memoizer import memoize, MemoizerContext, InMemoryCache, FileCache, SqliteCache
+from memoizer.caches import NoOpCache
+from memoizer.core import CallId, NodeId, Metadata, _call_to_id
+from memoizer.html_templates import render_html
+from memoizer.memoize import logger
+
+_ASOF = datetime(2024, 4, 26)
+_SMALL_ARGS = ('abc', 1, 3.14, None)
+_LARGE_ARGS = (list(range(1000)), {str(i): (i, float(i)) for i in range(200)})
+_DEPTH = 100
+_benchmarks = []
+_cleanups = []
+
+def benchmark(number: int, needs_pandas: bool = False, threshold: float = None):
+    "registers a benchmark: a function doing its setup and returning the operation to time `number` times"
+    def register(setup):
+        _benchmarks.append((setup.__name__, setup, number, needs_pandas, threshold))
+        return setup
+    return register
+
+@memoize
+def _node(n):
+    return n
+
+@memoize
+def _chain(n):
+    return _chain(n - 1) + 1 if n > 0 else 0
+
+def _metadata(node_id: NodeId) -> Metadata:
+    call_id, asof = node_id.to_call_id_and_asof()
+    children = [NodeId.from_call(asof, _node, i) for i in range(5)]
+    return Metadata(node_id, call_id, asof, __name__, '_node', (), {}, children, _ASOF, _ASOF, 0.5, 'def _node(n):\n    return n\n', 'int')
+
+def _dataframe(rows: int):
+    import pandas as pd
+    return pd.DataFrame({'a': range(rows), 'b': [float(i) for i in range(rows)], 'c': [str(i) for i in range(rows)]})
+
+def _counter():
+    count = [0]
+    def next_value():
+        count[0] += 1
+        return count[0]
+    return next_value
+
+@benchmark(number=10000)
+def call_to_id_small_args():
+    return lambda: _call_to_id(_node, *_SMALL_ARGS)
+
+@benchmark(number=100)
+def call_to_id_large_args():
+    return lambda: _call_to_id(_node, *_LARGE_ARGS)
+
+@benchmark(number=2000)
+def call_id_to_call_small_args():
+    call_id = CallId.from_call(_node, *_SMALL_ARGS)
+    return lambda: CallId(call_id.id).to_call()
+
+@benchmark(number=20)
+def call_id_to_call_large_args():
+    call_id = CallId.from_call(_node, *_LARGE_ARGS)
+    return lambda: CallId(call_id.id).to_call()
+
+@benchmark(number=10000)
+def node_id_fname():
+    node_id = NodeId.from_call(_ASOF, _node, *_SMALL_ARGS)
+    return lambda: NodeId(node_id.id).to_fname()
+
+@benchmark(number=10000)
+def metadata_encode_decode():
+    metadata = _metadata(NodeId.from_call(_ASOF, _node, 1))
+    return lambda: Metadata.decode(metadata.encode())
+
+@benchmark(number=10000)
+def eval_cache_hit():
+    context = MemoizerContext(cache=InMemoryCache(), asof=_ASOF)
+    with context:
+        _node(1)
+    def op():
+        with context:
+            _node(1)
+    return op
+
+@benchmark(number=1000)
+def eval_cache_miss():
+    context = MemoizerContext(cache=InMemoryCache(), asof=_ASOF)
+    next_value = _counter()
+    def op():
+        with context:
+            _node(next_value())
+    return op
+
+@benchmark(number=1000)
+def eval_no_cache():
+    context = MemoizerContext(cache=NoOpCache(), asof=_ASOF)
+    def op():
+        with context:
+            _node(1)
+    return op
+
+@benchmark(number=10)
+def deep_dag_miss():
+    def op():
+        with MemoizerContext(cache=InMemoryCache(), asof=_ASOF):
+            _chain(_DEPTH)
+    return op
+
+@benchmark(number=1000)
+def deep_dag_hit():
+    context = MemoizerContext(cache=InMemoryCache(), asof=_ASOF)
+    with context:
+        _chain(_DEPTH)
+    def op():
+        with context:
+            _chain(_DEPTH)
+    return op
+
+@benchmark(number=5000)
+def inmemory_cache_eviction_churn():
+    cache = InMemoryCache(capacity_bytes=100000)
+    metadata = _metadata(NodeId.from_call(_ASOF, _node, 0))
+    next_value = _counter()
+    return lambda: cache.write(NodeId.from_call(_ASOF, _node, next_value()), list(range(100)), metadata)
+
+def _cache_write(make_cache, result):
+    folder = tempfile.mkdtemp()
+    _cleanups.append(lambda: shutil.rmtree(folder))
+    cache = make_cache(folder + '/')
+    metadata = _metadata(NodeId.from_call(_ASOF, _node, 0))
+    next_value = _counter()
+    return lambda: cache.write(NodeId.from_call(_ASOF, _node, next_value()), result, metadata)
+
+def _cache_read(make_cache, result):
+    folder = tempfile.mkdtemp()
+    _cleanups.append(lambda: shutil.rmtree(folder))
+    cache = make_cache(folder + '/')
+    node_id = NodeId.from_call(_ASOF, _node, 0)
+    cache.write(node_id, result, _metadata(node_id))
+    cache = make_cache(folder + '/') # a fresh instance, so that reads are not served by its in-memory layer
+    return lambda: cache.read_result(NodeId(node_id.id))
+
+_file_cache = lambda path: FileCache(path, inmemory_cache_capacity_bytes=1)
+_sqlite_cache = lambda path: SqliteCache(path + 'cache.db')
+_large_result = lambda: [float(i) for i in range(100000)]
+
+@benchmark(number=500, threshold=5.)
+def file_cache_write_small():
+    return _cache_write(_file_cache, 42)
+
+@benchmark(number=2000)
+def file_cache_read_small():
+    return _cache_read(_file_cache, 42)
+
+@benchmark(number=20, threshold=5.)
+def file_cache_write_large():
+    return _cache_write(_file_cache, _large_result())
+
+@benchmark(number=50)
+def file_cache_read_large():
+    return _cache_read(_file_cache, _large_result())
+
+@benchmark(number=20, needs_pandas=True, threshold=5.)
+def file_cache_write_dataframe():
+    return _cache_write(_file_cache, _dataframe(100000))
+
+@benchmark(number=50, needs_pandas=True)
+def file_cache_read_dataframe():
+    return _cache_read(_file_cache, _dataframe(100000))
+
+@benchmark(number=500, threshold=5.)
+def sqlite_cache_write_small():
+    return _cache_write(_sqlite_cache, 42)
+
+@benchmark(number=2000)
+def sqlite_cache_read_small():
+    return _cache_read(_sqlite_cache, 42)
+
+@benchmark(number=1000)
+def render_html_small():
+    node_id = NodeId.from_call(_ASOF, _node, 1)
+    metadata = _metadata(node_id)
+    return lambda: render_html({'a': list(range(10))}, metadata, lambda node_id: '', lambda node_id: '')
+
+@benchmark(number=20, needs_pandas=True)
+def render_html_dataframe():
+    node_id = NodeId.from_call(_ASOF, _node, 1)
+    metadata = _metadata(node_id)
+    df = _dataframe(1000)
+    return lambda: render_html(df, metadata, lambda node_id: '', lambda node_id: '')
+
+@benchmark(number=20, needs_pandas=True)
+def render_csv_dataframe():
+    from memoizer.web import handle_download_csv
+    cache = InMemoryCache()
+    node_id = NodeId.from_call(_ASOF, _node, 1)
+    cache.write(node_id, _dataframe(10000), _metadata(node_id))
+    return lambda: handle_download_csv(cache, node_id)
+
+def run(names_filter: str = None, repeat: int = 5, scale: float = 1.) -> dict:
+    try:
+        import pandas
+        pandas_version = pandas.__version__
+    except ImportError:
+        pandas_version = None
+    logger().setLevel(logging.WARNING)
+    results = {}
+    for name, setup, number, needs_pandas, threshold in _benchmarks:
+        if names_filter is not None and names_filter not in name: continue
+        if needs_pandas and pandas_version is None: continue
+        op = setup()
+        n = max(1, int(number * scale))
+        sec_per_op = min(timeit.repeat(op, number=n, repeat=repeat)) / n
+        while len(_cleanups) > 0:
+            _cleanups.pop()()
+        results[name] = {'sec_per_op': sec_per_op, 'number': n, 'repeat': repeat, 'threshold': threshold}
+        print(f"{name:40s} {sec_per_op * 1e6:12.2f} us")
+    return {
+        'meta': {'python': platform.python_version(), 'platform': platform.platform(), 'pandas': pandas_version, 'time': datetime.now().isoformat()},
+        'results': results,
+    }
+
+def compare(results: dict, baseline: dict, threshold: float) -> list:
+    """
+    returns the names of benchmarks slower than `threshold`, or their own larger threshold, times their
+    baseline, and of those missing from the baseline
+    """
+    regressions = []
+    for name, result in results['results'].items():
+        if name not in baseline['results']:
+            regressions.append(name)
+            print(f"{name:40s} {'':8s}  NO BASELINE")
+            continue
+        ratio = result['sec_per_op'] / baseline['results'][name]['sec_per_op']
+        regressed = ratio > max(threshold, result.get('threshold') or 0)
+        if regressed: regressions.append(name)
+        print(f"{name:40s} {ratio:8.2f}x baseline{'  REGRESSION' if regressed else ''}")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description='memoizer benchmarks')
+    parser.add_argument('--filter', default=None, help='only run benchmarks whose name contains this')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--scale', type=float, default=1., help='multiplies the number of operations timed per run')
+    parser.add_argument('--output', default=None, help='json file to write the results to')
+    parser.add_argument('--baseline', default=None, help='json file of results to compare against')
+    parser.add_argument('--threshold', type=float, default=2., help='slowdown ratio reported as a regression')
+    args = parser.parse_args()
+    results = run(args.filter, args.repeat, args.scale)
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if len(compare(results, baseline, args.threshold)) > 0:
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -1,5 +1,4 @@
-from memoizer.memoize import memoize, blow_cache, node_fname
-from memoizer.caches import InMemoryCache, FileCache
+from memoizer.memoize import memoize, blow_cache, node_fname, wait_for_fresh
+from memoizer.caches import InMemoryCache, FileCache, SharedMemoryCache, SqliteCache
 from memoizer.context import MemoizerContext, current_cache, current_asof
-from memoizer.html_templates import Html
-from .core import datetime_from_str, datetime_to_str
\ No newline at end of file
+from .core import Html, datetime_from_str, datetime_to_str
\ No newline at end of file
@@ -1,7 +1,9 @@
 from abc import ABC, abstractmethod
 from collections import OrderedDict
-from typing import List, Union
-from memoizer.core import NodeId, CallId, Metadata, datetime_to_str, is_windows
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Iterable, List, Tuple, Union
+from memoizer.core import NodeId, CallId, Metadata, _METADATA_MAGIC, _datetime_to_ints, _datetime_from_ints, datetime_from_str, is_windows, sha256, _hex
 from io import BytesIO
 import pickle
 
@@ -61,7 +63,7 @@ class NoOpCache(AbstractCache):
         return []
 
     def get_latest_node_id_by_call_id(self, call_id: CallId) -> Union[NodeId, None]:
-        return []
+        return None
 
 class InMemoryCache(AbstractCache):
     def __init__(self, capacity_bytes = None) -> None:
@@ -85,7 +87,7 @@ class InMemoryCache(AbstractCache):
         return self._read(node_id)[0]
 
     def read_metadata(self, node_id: NodeId) -> Metadata:
-        return self._read(node_id)[0]
+        return self._read(node_id)[1]
     
     def _read(self, node_id: NodeId):
         key = InMemoryCache._key(node_id)
@@ -108,18 +110,28 @@ class InMemoryCache(AbstractCache):
         return list(set([NodeId(_id) for _id in self.cache.keys()]))
 
     def list_node_ids_by_call_id(self, call_id: CallId) -> List[NodeId]:
-        raise NotImplementedError()
+        assert type(call_id) is CallId
+        prefix = call_id.id + '@'
+        node_ids = [NodeId(_id) for _id in self.cache.keys() if _id.startswith(prefix)]
+        return sorted(node_ids, key=lambda node_id: node_id.to_call_id_and_asof()[1])
 
     def get_latest_node_id_by_call_id(self, call_id: CallId) -> Union[NodeId, None]:
-        raise NotImplementedError()
+        node_ids = self.list_node_ids_by_call_id(call_id)
+        return node_ids[-1] if len(node_ids) > 0 else None
     
     @staticmethod
     def _key(node_id: NodeId):
         assert type(node_id) is NodeId
         return node_id.id
 
-from os import makedirs, remove, listdir
-from os.path import isfile, join
+from os import makedirs, remove, listdir, link, replace, stat, getpid
+from os.path import isfile, isdir, join
+from tempfile import gettempdir
+from time import monotonic_ns
+import os
+import struct
+import sys
+import threading
 
 def list_files(path):
     "lists files in a folder"
@@ -143,20 +155,51 @@ def remove_file(path):
 def makedir(path):
     makedirs(path, exist_ok=True)
 
+def link_file(src, dst):
+    link(src, dst)
+
+def count_links(path):
+    return stat(path).st_nlink
+
+def replace_file(fullpath, contents):
+    "writes a temporary file and moves it over `fullpath`, so that other links to the old file keep their content"
+    tmp_fname = f"{fullpath}.{_tmp_suffix()}.tmp"
+    write_file(tmp_fname, contents)
+    replace(tmp_fname, fullpath)
+
+def _tmp_suffix():
+    "unique per writing thread, for temporary files that are renamed into place"
+    return f"{getpid()}.{threading.get_ident()}"
+
 class FileCache(AbstractCache):
     _RESULT_EXT = '.res.pickle'
     _METADATA_EXT = '.metadata.pickle'
-
-    def __init__(self, path, inmemory_cache_capacity_bytes = 0) -> None:
+    _BLOBS_FOLDER = 'blobs'
+    _BLOB_EXT = '.pickle'
+
+    def __init__(self, path, inmemory_cache_capacity_bytes = 0, dedup = False) -> None:
+        """
+        With dedup=True results are stored once per distinct serialized content in a
+        content-addressed blob store under `path`, and each node's result file is a hard link
+        to its blob. The link count of a blob is its reference count: removing a node only
+        drops its link, and a blob is deleted when no node refers to it any more.
+        Readers are unaffected, and writers in either mode move a new result file into place
+        rather than writing into the existing one, which may be a link to a shared blob, so
+        deduplicated and plain caches can share a folder.
+        """
         assert path.endswith('/') or (is_windows and path.endswith('\\'))
         self.inmemorycache = InMemoryCache(inmemory_cache_capacity_bytes)
         self.path = path
+        self.dedup = dedup
 
     def write(self, node_id: NodeId, result: object, metadata: Metadata) -> None:
-        _, asof = node_id.to_call_id_and_asof()
-        makedir(self._folder(asof))
-        write_file(self._fname(node_id, FileCache._RESULT_EXT), _serialize(result))
-        write_file(self._fname(node_id, FileCache._METADATA_EXT), _serialize(metadata))
+        makedir(f"{self.path}{node_id.to_folder()}/")
+        result_fname = self._fname(node_id, FileCache._RESULT_EXT)
+        if self.dedup:
+            self._write_blob_link(result_fname, _serialize(result))
+        else:
+            replace_file(result_fname, _serialize(result))
+        write_file(self._fname(node_id, FileCache._METADATA_EXT), metadata.encode())
         self.inmemorycache.write(node_id, result, metadata)
 
     def read_result(self, node_id: NodeId) -> object:
@@ -166,15 +209,23 @@ class FileCache(AbstractCache):
 
     def read_metadata(self, node_id: NodeId) -> Metadata:
         if self.inmemorycache.contains(node_id):
-            return self.inmemorycache.read_result(node_id)
-        return _deserialize(read_file(self._fname(node_id, FileCache._METADATA_EXT)))
+            return self.inmemorycache.read_metadata(node_id)
+        return _deserialize_metadata(read_file(self._fname(node_id, FileCache._METADATA_EXT)))
     
     def contains(self, node_id: NodeId) -> bool:
         return self.inmemorycache.contains(node_id) or exists_file(self._fname(node_id, FileCache._RESULT_EXT))
 
     def remove(self, node_id: NodeId) -> None:
         # TODO would be nice clean up empty folder
-        remove_file(self._fname(node_id, FileCache._RESULT_EXT))
+        result_fname = self._fname(node_id, FileCache._RESULT_EXT)
+        if self.dedup and count_links(result_fname) == 2:
+            # last node referring to this blob, the only other link is the blob itself
+            blob_fname = self._blob_fname(read_file(result_fname))
+            remove_file(result_fname)
+            if exists_file(blob_fname) and count_links(blob_fname) == 1:
+                remove_file(blob_fname)
+        else:
+            remove_file(result_fname)
         remove_file(self._fname(node_id, FileCache._METADATA_EXT))
         if self.inmemorycache.contains(node_id):
             self.inmemorycache.remove(node_id)
@@ -183,31 +234,634 @@ class FileCache(AbstractCache):
         raise NotImplementedError()
 
     def list_node_ids_by_call_id(self, call_id: CallId) -> List[NodeId]:
-        raise NotImplementedError()
+        assert type(call_id) is CallId
+        if not isdir(self.path): return [] # created on the first write
+        asofs = sorted(asof for asof in (_asof_from_folder(folder) for folder in listdir(self.path)) if asof is not None)
+        node_ids = [NodeId.from_call_id_and_asof(call_id, asof) for asof in asofs]
+        return [node_id for node_id in node_ids if self.contains(node_id)]
 
     def get_latest_node_id_by_call_id(self, call_id: CallId) -> Union[NodeId, None]:
-        raise NotImplementedError()
-    
-    def _folder(self, asof):
-        asof_folder = datetime_to_str(asof).replace(":","-")
-        return f"{self.path}{asof_folder}/"
+        node_ids = self.list_node_ids_by_call_id(call_id)
+        return node_ids[-1] if len(node_ids) > 0 else None
     
+    def gc(self) -> int:
+        """removes blobs that no node refers to any more, returns the number of blobs removed"""
+        removed = 0
+        for blob_fname in self._list_blobs():
+            if count_links(blob_fname) == 1:
+                remove_file(blob_fname)
+                removed += 1
+        return removed
+
+    def stats(self) -> dict:
+        """
+        Reports the blob store: `logical_bytes` is what the deduplicated results would take
+        if every node had its own copy, `stored_bytes` is what they actually take.
+        """
+        blobs, references, logical_bytes, stored_bytes = 0, 0, 0, 0
+        for blob_fname in self._list_blobs():
+            st = stat(blob_fname)
+            blobs += 1
+            references += st.st_nlink - 1
+            logical_bytes += st.st_size * (st.st_nlink - 1)
+            stored_bytes += st.st_size
+        return {
+            'blobs': blobs,
+            'references': references,
+            'logical_bytes': logical_bytes,
+            'stored_bytes': stored_bytes,
+            'dedup_ratio': logical_bytes / stored_bytes if stored_bytes > 0 else 1.0,
+        }
+
+    def _write_blob_link(self, result_fname: str, content: bytes) -> None:
+        # the link is made under a temporary name and moved over the result file, so that
+        # concurrent writers of the same node each replace it atomically instead of colliding
+        blob_fname = self._blob_fname(content)
+        link_fname = f"{result_fname}.{_tmp_suffix()}.tmp"
+        while True:
+            if not exists_file(blob_fname):
+                makedir(blob_fname[:blob_fname.rfind('/') + 1])
+                replace_file(blob_fname, content)
+            try:
+                link_file(blob_fname, link_fname)
+            except FileNotFoundError:
+                continue # blob was garbage collected by another process in the meantime, write it again
+            except FileExistsError:
+                remove_file(link_fname) # left over by a writer that died, with a recycled pid
+                continue
+            replace(link_fname, result_fname)
+            if exists_file(link_fname):
+                remove_file(link_fname) # rename is a no-op when the result file already linked to the same blob
+            return
+
+    def _blob_fname(self, content: bytes) -> str:
+        digest = _hex(sha256(content))
+        return f"{self.path}{FileCache._BLOBS_FOLDER}/{digest[:2]}/{digest}{FileCache._BLOB_EXT}"
+
+    def _list_blobs(self) -> List[str]:
+        blobs_folder = f"{self.path}{FileCache._BLOBS_FOLDER}/"
+        if not isdir(blobs_folder): return []
+        return [blob_fname for prefix in sorted(listdir(blobs_folder)) for blob_fname in list_files(blobs_folder + prefix) if blob_fname.endswith(FileCache._BLOB_EXT)]
+
     def _fname(self, node_id: NodeId, extension: str):
         assert type(node_id) is NodeId
-        call_id, asof = node_id.to_call_id_and_asof()
-        folder = self._folder(asof)
-        return folder + call_id.to_fname() + extension
+        return f"{self.path}{node_id.to_folder()}/{node_id.to_fname()}{extension}"
     
     @staticmethod
     def _key(node_id: NodeId):
         assert type(node_id) is NodeId
         return node_id.id
 
+class SharedMemoryCache(AbstractCache):
+    """
+    In-memory cache shared by all processes on a host, attached to by `name`.
+    A shared index segment maps a hash of the node id to one shared memory segment per entry.
+    Reads take no lock: every entry segment repeats the hash of its node id, so a read racing
+    with a writer either finds the entry it asked for or misses. Writes, removals and eviction
+    of the least recently read entries to stay within `capacity_bytes` serialize on a file lock.
+    Results are pickled with protocol 5, so large buffers (numpy arrays, DataFrame blocks) are
+    read as read-only views straight into shared memory. Such views stay valid after their entry
+    is evicted, as unlinking a segment does not unmap it from processes that still use it.
+    Segments outlive the processes that use them until evicted, removed, or `unlink` is called.
+    """
+    _MAGIC = b'MEMOSHM1'
+    _HEADER = struct.Struct('<8sQQQQQQ') # magic, n_slots, capacity_bytes, used_bytes, generation, live slots, deleted slots
+    _SLOT = struct.Struct('<16sQQQB7x') # node id hash, generation, size, last read, state
+    _SEGMENT_HEADER = struct.Struct('<16sQQQ') # node id hash, metadata length, result length, number of out-of-band buffers
+    _EMPTY, _USED, _DELETED = 0, 1, 2
+    _ALIGN = 64
+    _MAX_MAPPINGS = 1024
+
+    def __init__(self, name: str, capacity_bytes: int = 1 << 30, n_slots: int = 1 << 16) -> None:
+        self.name = name
+        self._mappings = OrderedDict()
+        self._retired = []
+        self._lock_fname = join(gettempdir(), f"{name}.lock")
+        with self._lock():
+            try:
+                self._index_shm = _open_shared_memory(name)
+            except FileNotFoundError:
+                self._index_shm = _open_shared_memory(name, SharedMemoryCache._HEADER.size + n_slots * SharedMemoryCache._SLOT.size)
+                SharedMemoryCache._HEADER.pack_into(self._index_shm.buf, 0, SharedMemoryCache._MAGIC, n_slots, capacity_bytes, 0, 0, 0, 0)
+        magic, self.n_slots, self.capacity_bytes, *_ = SharedMemoryCache._HEADER.unpack_from(self._index_shm.buf)
+        assert magic == SharedMemoryCache._MAGIC, magic
+
+    def __getstate__(self):
+        return {'name': self.name}
+
+    def __setstate__(self, state):
+        self.__init__(state['name'])
+
+    def write(self, node_id: NodeId, result: object, metadata: Metadata) -> None:
+        digest = SharedMemoryCache._digest(node_id)
+        buffers = []
+        result_bytes = pickle.dumps(result, protocol=5, buffer_callback=buffers.append)
+        buffers = [buffer.raw() for buffer in buffers]
+        metadata_bytes = metadata.encode()
+        layout = [len(metadata_bytes), len(result_bytes)] + [len(buffer) for buffer in buffers]
+        offsets = SharedMemoryCache._offsets(len(buffers), layout)
+        size = offsets[-1] + layout[-1]
+        if size >= self.capacity_bytes: return
+        with self._lock():
+            self._remove_locked(digest)
+            self._evict_locked(size)
+            header = list(self._header())
+            header[4] += 1
+            generation = header[4]
+            shm = _open_shared_memory(self._segment_name(generation), size)
+            SharedMemoryCache._SEGMENT_HEADER.pack_into(shm.buf, 0, digest, len(metadata_bytes), len(result_bytes), len(buffers))
+            struct.pack_into(f'<{len(buffers)}Q', shm.buf, SharedMemoryCache._SEGMENT_HEADER.size, *layout[2:])
+            for offset, content in zip(offsets, [metadata_bytes, result_bytes] + buffers):
+                shm.buf[offset:(offset + len(content))] = content
+            shm.close()
+            i, state = self._probe(digest, for_insert=True)
+            header[3] += size
+            header[5] += 1
+            header[6] -= state == SharedMemoryCache._DELETED
+            SharedMemoryCache._SLOT.pack_into(self._index_shm.buf, self._slot_offset(i), digest, generation, size, monotonic_ns(), SharedMemoryCache._USED)
+            SharedMemoryCache._HEADER.pack_into(self._index_shm.buf, 0, *header)
+
+    def read_result(self, node_id: NodeId) -> object:
+        shm, n_buffers, metadata_len, result_len = self._read(node_id)
+        buffer_lengths = struct.unpack_from(f'<{n_buffers}Q', shm.buf, SharedMemoryCache._SEGMENT_HEADER.size)
+        layout = [metadata_len, result_len] + list(buffer_lengths)
+        offsets = SharedMemoryCache._offsets(n_buffers, layout)
+        view = shm.buf.toreadonly()
+        buffers = [view[offset:(offset + length)] for offset, length in zip(offsets[2:], layout[2:])]
+        return pickle.loads(view[offsets[1]:(offsets[1] + result_len)], buffers=buffers)
+
+    def read_metadata(self, node_id: NodeId) -> Metadata:
+        shm, n_buffers, metadata_len, _ = self._read(node_id)
+        offset = SharedMemoryCache._offsets(n_buffers, [metadata_len])[0]
+        return Metadata.decode(bytes(shm.buf[offset:(offset + metadata_len)]))
+
+    def contains(self, node_id: NodeId) -> bool:
+        return self._lookup(SharedMemoryCache._digest(node_id)) is not None
+
+    def remove(self, node_id: NodeId) -> None:
+        with self._lock():
+            assert self._remove_locked(SharedMemoryCache._digest(node_id)), node_id.id
+
+    def list_node_ids(self) -> List[NodeId]:
+        node_ids = []
+        for _, _, generation, _, _ in self._live_slots():
+            try:
+                node_ids.append(self._read_metadata_of_segment(generation).node_id)
+            except FileNotFoundError:
+                pass # evicted in the meantime
+        return node_ids
+
+    def list_node_ids_by_call_id(self, call_id: CallId) -> List[NodeId]:
+        assert type(call_id) is CallId
+        prefix = call_id.id + '@'
+        node_ids = [node_id for node_id in self.list_node_ids() if node_id.id.startswith(prefix)]
+        return sorted(node_ids, key=lambda node_id: node_id.to_call_id_and_asof()[1])
+
+    def get_latest_node_id_by_call_id(self, call_id: CallId) -> Union[NodeId, None]:
+        node_ids = self.list_node_ids_by_call_id(call_id)
+        return node_ids[-1] if len(node_ids) > 0 else None
+
+    def stats(self) -> dict:
+        _, n_slots, capacity_bytes, used_bytes, _, live, deleted = self._header()
+        return {'entries': live, 'used_bytes': used_bytes, 'capacity_bytes': capacity_bytes, 'n_slots': n_slots, 'deleted_slots': deleted}
+
+    def unlink(self) -> None:
+        "removes every entry and the index from shared memory, the cache cannot be used afterwards"
+        with self._lock():
+            for i, _, generation, _, _ in self._live_slots():
+                _unlink_shared_memory(self._segment_name(generation))
+            self._close_mappings()
+            self._index_shm.close()
+            _unlink_shared_memory(self.name)
+        remove_file(self._lock_fname)
+
+    def _read(self, node_id: NodeId):
+        digest = SharedMemoryCache._digest(node_id)
+        found = self._lookup(digest)
+        if found is not None:
+            i, generation = found
+            try:
+                shm = self._map(generation)
+            except FileNotFoundError:
+                shm = None # evicted in the meantime
+            if shm is not None:
+                segment_digest, metadata_len, result_len, n_buffers = SharedMemoryCache._SEGMENT_HEADER.unpack_from(shm.buf)
+                if segment_digest == digest:
+                    # last read time is updated without the lock, a lost update only makes eviction less accurate
+                    struct.pack_into('<Q', self._index_shm.buf, self._slot_offset(i) + 32, monotonic_ns())
+                    return shm, n_buffers, metadata_len, result_len
+        raise KeyError(node_id.id)
+
+    def _read_metadata_of_segment(self, generation: int) -> Metadata:
+        shm = self._map(generation)
+        _, metadata_len, _, n_buffers = SharedMemoryCache._SEGMENT_HEADER.unpack_from(shm.buf)
+        offset = SharedMemoryCache._offsets(n_buffers, [metadata_len])[0]
+        return Metadata.decode(bytes(shm.buf[offset:(offset + metadata_len)]))
+
+    def _lookup(self, digest: bytes):
+        i, state = self._probe(digest, for_insert=False)
+        if state != SharedMemoryCache._USED: return None
+        _, generation, _, _, _ = SharedMemoryCache._SLOT.unpack_from(self._index_shm.buf, self._slot_offset(i))
+        return i, generation
+
+    def _probe(self, digest: bytes, for_insert: bool):
+        "open addressing with linear probing, returns the slot holding `digest` or the slot to insert it into"
+        start = int.from_bytes(digest[:8], 'little') % self.n_slots
+        first_deleted = None
+        for k in range(self.n_slots):
+            i = (start + k) % self.n_slots
+            slot_digest, _, _, _, state = SharedMemoryCache._SLOT.unpack_from(self._index_shm.buf, self._slot_offset(i))
+            if state == SharedMemoryCache._EMPTY:
+                break
+            if state == SharedMemoryCache._USED and slot_digest == digest:
+                return i, state
+            if state == SharedMemoryCache._DELETED and first_deleted is None:
+                first_deleted = i
+        else:
+            i = None
+        if for_insert and first_deleted is not None:
+            return first_deleted, SharedMemoryCache._DELETED
+        return i, SharedMemoryCache._EMPTY
+
+    def _remove_locked(self, digest: bytes) -> bool:
+        found = self._lookup(digest)
+        if found is None: return False
+        i, generation = found
+        _, _, size, _, _ = SharedMemoryCache._SLOT.unpack_from(self._index_shm.buf, self._slot_offset(i))
+        SharedMemoryCache._SLOT.pack_into(self._index_shm.buf, self._slot_offset(i), digest, generation, 0, 0, SharedMemoryCache._DELETED)
+        header = list(self._header())
+        header[3] -= size
+        header[5] -= 1
+        header[6] += 1
+        SharedMemoryCache._HEADER.pack_into(self._index_shm.buf, 0, *header)
+        self._unmap(generation)
+        _unlink_shared_memory(self._segment_name(generation))
+        return True
+
+    def _evict_locked(self, size: int) -> None:
+        _, _, _, used_bytes, _, live, deleted = self._header()
+        # keep at least a quarter of the slots empty so that probing stays short and terminates
+        if used_bytes + size > self.capacity_bytes or live + 1 > self.n_slots // 2:
+            for _, digest, _, _, _ in sorted(self._live_slots(), key=lambda slot: slot[4]):
+                self._remove_locked(digest)
+                _, _, _, used_bytes, _, live, deleted = self._header()
+                if used_bytes + size <= self.capacity_bytes and live + 1 <= self.n_slots // 2: break
+        if live + deleted + 1 > 3 * self.n_slots // 4:
+            self._rehash_locked()
+
+    def _rehash_locked(self) -> None:
+        "drops deleted slots, readers racing with this may see a miss"
+        slots = self._live_slots()
+        buf = self._index_shm.buf
+        start = SharedMemoryCache._HEADER.size
+        buf[start:(start + self.n_slots * SharedMemoryCache._SLOT.size)] = bytes(self.n_slots * SharedMemoryCache._SLOT.size)
+        for _, digest, generation, size, last_read in slots:
+            i, _ = self._probe(digest, for_insert=True)
+            SharedMemoryCache._SLOT.pack_into(buf, self._slot_offset(i), digest, generation, size, last_read, SharedMemoryCache._USED)
+        header = list(self._header())
+        header[6] = 0
+        SharedMemoryCache._HEADER.pack_into(buf, 0, *header)
+
+    def _live_slots(self):
+        slots = []
+        for i, (digest, generation, size, last_read, state) in enumerate(SharedMemoryCache._SLOT.iter_unpack(self._index_shm.buf[SharedMemoryCache._HEADER.size:])):
+            if state == SharedMemoryCache._USED:
+                slots.append((i, digest, generation, size, last_read))
+        return slots
+
+    def _header(self):
+        return SharedMemoryCache._HEADER.unpack_from(self._index_shm.buf)
+
+    def _map(self, generation: int):
+        name = self._segment_name(generation)
+        if name in self._mappings:
+            self._mappings.move_to_end(name)
+            return self._mappings[name]
+        shm = _open_shared_memory(name)
+        self._mappings[name] = shm
+        if len(self._mappings) > SharedMemoryCache._MAX_MAPPINGS:
+            self._retired.append(self._mappings.popitem(last=False)[1])
+            self._close_retired()
+        return shm
+
+    def _unmap(self, generation: int):
+        name = self._segment_name(generation)
+        if name in self._mappings:
+            self._retired.append(self._mappings.pop(name))
+            self._close_retired()
+
+    def _close_retired(self):
+        # mappings still referenced by zero-copy results cannot be closed yet, they are retried later
+        retired, self._retired = self._retired, []
+        for shm in retired:
+            try:
+                shm.close()
+            except BufferError:
+                self._retired.append(shm)
+
+    def _close_mappings(self):
+        self._retired.extend(self._mappings.values())
+        self._mappings.clear()
+        self._close_retired()
+
+    def _segment_name(self, generation: int) -> str:
+        return f"{self.name}_{generation:x}"
+
+    def _slot_offset(self, i: int) -> int:
+        return SharedMemoryCache._HEADER.size + i * SharedMemoryCache._SLOT.size
+
+    def _lock(self):
+        return _FileLock(self._lock_fname)
+
+    @staticmethod
+    def _offsets(n_buffers: int, lengths: List[int]) -> List[int]:
+        "offsets of metadata, result and out-of-band buffers in an entry segment, buffers are aligned"
+        offsets = [SharedMemoryCache._SEGMENT_HEADER.size + 8 * n_buffers]
+        for i, length in enumerate(lengths[:-1]):
+            offset = offsets[-1] + length
+            if i >= 1:
+                offset = -(-offset // SharedMemoryCache._ALIGN) * SharedMemoryCache._ALIGN
+            offsets.append(offset)
+        return offsets
+
+    @staticmethod
+    def _digest(node_id: NodeId) -> bytes:
+        assert type(node_id) is NodeId
+        return sha256(node_id.id.encode('utf-8'))[:16]
+
+class SqliteCache(AbstractCache):
+    """
+    Cache in a single SQLite database file, for many small results where a file per node costs
+    more than the result itself. The database is in WAL mode, so readers in any number of processes
+    do not block each other or the writer. Nodes are keyed by (call id, asof), which also serves
+    lookups by call id and of the latest asof. Results of at least `spill_threshold_bytes` are kept
+    next to the database in files named by the hash of their content.
+    Writes inside `with cache.transaction():` are committed together.
+    """
+    _BLOBS_EXT = '.blobs'
+    _SCHEMA = [
+        'CREATE TABLE IF NOT EXISTS nodes (call_id TEXT NOT NULL, asof INTEGER NOT NULL, metadata BLOB NOT NULL, result BLOB, blob TEXT, PRIMARY KEY (call_id, asof)) WITHOUT ROWID',
+        'CREATE INDEX IF NOT EXISTS nodes_blob ON nodes (blob) WHERE blob IS NOT NULL',
+    ]
+
+    def __init__(self, path: str, spill_threshold_bytes: int = 1 << 20) -> None:
+        self.path = path
+        self.spill_threshold_bytes = spill_threshold_bytes
+        self._local = threading.local()
+        with self.transaction() as db:
+            for statement in SqliteCache._SCHEMA:
+                db.execute(statement)
+
+    def __getstate__(self):
+        return {'path': self.path, 'spill_threshold_bytes': self.spill_threshold_bytes}
+
+    def __setstate__(self, state):
+        self.__init__(state['path'], state['spill_threshold_bytes'])
+
+    def write(self, node_id: NodeId, result: object, metadata: Metadata) -> None:
+        call_id, asof = SqliteCache._key(node_id)
+        content = _serialize(result)
+        with self.transaction() as db:
+            previous_blob = db.execute('SELECT blob FROM nodes WHERE call_id = ? AND asof = ?', (call_id, asof)).fetchone()
+            blob = None
+            if len(content) >= self.spill_threshold_bytes:
+                blob = _hex(sha256(content))
+                if not exists_file(self._blob_fname(blob)):
+                    makedir(f"{self.path}{SqliteCache._BLOBS_EXT}/")
+                    tmp_fname = f"{self._blob_fname(blob)}.{getpid()}.tmp"
+                    write_file(tmp_fname, content)
+                    replace(tmp_fname, self._blob_fname(blob))
+                content = None
+            db.execute('INSERT OR REPLACE INTO nodes (call_id, asof, metadata, result, blob) VALUES (?, ?, ?, ?, ?)', (call_id, asof, metadata.encode(), content, blob))
+            if previous_blob is not None and previous_blob[0] not in (None, blob):
+                self._local.orphans.add(previous_blob[0])
+
+    def write_many(self, items: Iterable[Tuple[NodeId, object, Metadata]]) -> None:
+        with self.transaction():
+            for node_id, result, metadata in items:
+                self.write(node_id, result, metadata)
+
+    def read_result(self, node_id: NodeId) -> object:
+        result, blob = self._read(node_id, 'result, blob')
+        while blob is not None:
+            try:
+                return _deserialize(read_file(self._blob_fname(blob)))
+            except FileNotFoundError:
+                # removed by a concurrent remove or overwrite since the row was read: read the row
+                # again, which raises KeyError if the node is gone, and miss if it still names this blob
+                previous_blob = blob
+                result, blob = self._read(node_id, 'result, blob')
+                if blob == previous_blob: raise KeyError(node_id.id)
+        return _deserialize(result)
+
+    def read_metadata(self, node_id: NodeId) -> Metadata:
+        return Metadata.decode(self._read(node_id, 'metadata')[0])
+
+    def contains(self, node_id: NodeId) -> bool:
+        return self._db().execute('SELECT 1 FROM nodes WHERE call_id = ? AND asof = ?', SqliteCache._key(node_id)).fetchone() is not None
+
+    def remove(self, node_id: NodeId) -> None:
+        key = SqliteCache._key(node_id)
+        with self.transaction() as db:
+            row = db.execute('SELECT blob FROM nodes WHERE call_id = ? AND asof = ?', key).fetchone()
+            if row is None: raise KeyError(node_id.id)
+            db.execute('DELETE FROM nodes WHERE call_id = ? AND asof = ?', key)
+            if row[0] is not None:
+                self._local.orphans.add(row[0])
+
+    def list_node_ids(self) -> List[NodeId]:
+        return [SqliteCache._node_id(call_id, asof) for call_id, asof in self._db().execute('SELECT call_id, asof FROM nodes')]
+
+    def list_node_ids_by_call_id(self, call_id: CallId) -> List[NodeId]:
+        assert type(call_id) is CallId
+        rows = self._db().execute('SELECT asof FROM nodes WHERE call_id = ? ORDER BY asof', (call_id.id,))
+        return [NodeId.from_call_id_and_asof(call_id, _asof_from_int(asof)) for (asof,) in rows]
+
+    def get_latest_node_id_by_call_id(self, call_id: CallId) -> Union[NodeId, None]:
+        assert type(call_id) is CallId
+        row = self._db().execute('SELECT asof FROM nodes WHERE call_id = ? ORDER BY asof DESC LIMIT 1', (call_id.id,)).fetchone()
+        return NodeId.from_call_id_and_asof(call_id, _asof_from_int(row[0])) if row is not None else None
+
+    def gc(self) -> int:
+        "removes spilled results that no node refers to any more, e.g. after a rolled back transaction, returns the number removed"
+        blobs_folder = f"{self.path}{SqliteCache._BLOBS_EXT}/"
+        if not isdir(blobs_folder): return 0
+        removed = 0
+        with self.transaction() as db:
+            for fname in listdir(blobs_folder):
+                blob = fname[:-len(FileCache._BLOB_EXT)]
+                if fname.endswith(FileCache._BLOB_EXT) and db.execute('SELECT 1 FROM nodes WHERE blob = ? LIMIT 1', (blob,)).fetchone() is None:
+                    remove_file(blobs_folder + fname)
+                    removed += 1
+        return removed
+
+    @contextmanager
+    def transaction(self):
+        """
+        an immediate transaction, nested ones join the outermost. Spilled results that removed or
+        overwritten nodes used are deleted once it commits, so that a rollback finds them again
+        """
+        db = self._db()
+        if self._local.depth == 0:
+            db.execute('BEGIN IMMEDIATE')
+        self._local.depth += 1
+        try:
+            yield db
+        except BaseException:
+            self._local.depth -= 1
+            if self._local.depth == 0:
+                self._local.orphans = set()
+                db.execute('ROLLBACK')
+            raise
+        self._local.depth -= 1
+        if self._local.depth == 0:
+            db.execute('COMMIT')
+            self._remove_orphans(db)
+
+    def _db(self):
+        # one connection per thread and process, connections must not cross a fork
+        if getattr(self._local, 'pid', None) != getpid():
+            import sqlite3
+            db = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('PRAGMA synchronous=NORMAL')
+            self._local.db = db
+            self._local.depth = 0
+            self._local.orphans = set() # spilled results no longer used within the current transaction
+            self._local.pid = getpid()
+        return self._local.db
+
+    def _read(self, node_id: NodeId, columns: str):
+        row = self._db().execute(f'SELECT {columns} FROM nodes WHERE call_id = ? AND asof = ?', SqliteCache._key(node_id)).fetchone()
+        if row is None: raise KeyError(node_id.id)
+        return row
+
+    def _remove_orphans(self, db) -> None:
+        # in a transaction of its own, so that no writer starts using one of them again in the meantime
+        orphans, self._local.orphans = self._local.orphans, set()
+        if len(orphans) == 0: return
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            for blob in orphans:
+                if db.execute('SELECT 1 FROM nodes WHERE blob = ? LIMIT 1', (blob,)).fetchone() is None and exists_file(self._blob_fname(blob)):
+                    remove_file(self._blob_fname(blob))
+        finally:
+            db.execute('COMMIT')
+
+    def _blob_fname(self, blob: str) -> str:
+        return f"{self.path}{SqliteCache._BLOBS_EXT}/{blob}{FileCache._BLOB_EXT}"
+
+    @staticmethod
+    def _key(node_id: NodeId) -> Tuple[str, int]:
+        assert type(node_id) is NodeId
+        call_id, asof = node_id.to_call_id_and_asof()
+        return call_id.id, _asof_to_int(asof)
+
+    @staticmethod
+    def _node_id(call_id: str, asof: int) -> NodeId:
+        return NodeId.from_call_id_and_asof(CallId(call_id), _asof_from_int(asof))
+
+def _asof_to_int(asof: datetime) -> int:
+    "microseconds since 0001-01-01, orders like the asof"
+    days, us = _datetime_to_ints(asof)
+    return days * 86400000000 + us
+
+def _asof_from_int(asof: int) -> datetime:
+    return _datetime_from_ints(*divmod(asof, 86400000000))
+
+def _open_shared_memory(name: str, size: int = 0):
+    """
+    attaches to the shared memory segment `name`, or creates it if `size` is given. Segments are
+    owned by the cache and not by a process, so they are kept away from the resource tracker,
+    which would unlink them at exit and which forked processes share, so that registering and
+    unregistering them per attach interleaves between processes and fails.
+    """
+    from multiprocessing import shared_memory
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name=name, create=size > 0, size=size, track=False)
+    if is_windows:
+        return shared_memory.SharedMemory(name=name, create=size > 0, size=size)
+    return _UntrackedSharedMemory(name, size)
+
+def _unlink_shared_memory(name: str) -> None:
+    if is_windows:
+        return # a segment is freed when its last handle is closed
+    import _posixshmem
+    try:
+        _posixshmem.shm_unlink('/' + name)
+    except FileNotFoundError:
+        pass
+
+class _UntrackedSharedMemory:
+    "a posix shared memory segment, as multiprocessing's SharedMemory before python 3.13 but not registered with the resource tracker"
+    def __init__(self, name: str, size: int = 0) -> None:
+        import _posixshmem
+        import mmap
+        flags = os.O_RDWR | (os.O_CREAT | os.O_EXCL if size > 0 else 0)
+        fd = _posixshmem.shm_open('/' + name, flags, mode=0o600)
+        try:
+            if size > 0:
+                os.ftruncate(fd, size)
+            else:
+                size = os.fstat(fd).st_size
+            self._mmap = mmap.mmap(fd, size)
+        finally:
+            os.close(fd)
+        self.name = name
+        self.buf = memoryview(self._mmap)
+
+    def close(self) -> None:
+        if self.buf is not None:
+            self.buf.release()
+            self.buf = None
+        if self._mmap is not None:
+            self._mmap.close() # raises BufferError while zero-copy results still use the mapping
+            self._mmap = None
+
+class _FileLock:
+    "exclusive lock shared by processes on a host"
+    def __init__(self, fname: str) -> None:
+        self.fname = fname
+
+    def __enter__(self):
+        self.file = open(self.fname, 'a+b')
+        if is_windows:
+            import msvcrt
+            self.file.seek(0)
+            msvcrt.locking(self.file.fileno(), msvcrt.LK_LOCK, 1)
+        else:
+            import fcntl
+            fcntl.flock(self.file.fileno(), fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, type, value, traceback):
+        if is_windows:
+            import msvcrt
+            self.file.seek(0)
+            msvcrt.locking(self.file.fileno(), msvcrt.LK_UNLCK, 1)
+        else:
+            import fcntl
+            fcntl.flock(self.file.fileno(), fcntl.LOCK_UN)
+        self.file.close()
+
+def _asof_from_folder(folder: str) -> Union[datetime, None]:
+    "inverse of NodeId.to_folder, None for folders that are not asofs"
+    s = folder if len(folder) <= 10 else folder[:11] + folder[11:].replace('-', ':')
+    try:
+        return datetime_from_str(s)
+    except Exception:
+        return None
+
 def _serialize(obj: object) -> bytes:
     buffer = BytesIO()
     pickle.dump(obj, buffer)
     return buffer.getvalue()
 
+def _deserialize_metadata(buffer: bytes) -> Metadata:
+    if buffer[:len(_METADATA_MAGIC)] == _METADATA_MAGIC:
+        return Metadata.decode(buffer)
+    return _deserialize(buffer) # written before the binary metadata encoding
+
 def _deserialize(buffer: bytes) -> object:
     buf = BytesIO(buffer)
     r = pickle.load(buf)
@@ -1,12 +1,24 @@
 from collections import namedtuple
 from .caches import AbstractCache, NoOpCache
-from datetime import datetime
+from datetime import datetime, timedelta
+import threading
 
-Context = namedtuple('Context', ['cache', 'asof', 'render_html', 'render_csv'])
-_default_context = Context(NoOpCache(), datetime.min, False, False)
+Context = namedtuple('Context', ['cache', 'asof', 'render_html', 'render_csv', 'max_staleness'])
+_default_context = Context(NoOpCache(), datetime.min, False, False, None)
+
+# The main thread's stack is the base of all threads: a thread that has not entered a context of
+# its own sees the main thread's current one, as when a single stack was shared by all threads.
+_base_contexts = [_default_context]
+
+class _Stack(threading.local):
+    def __init__(self):
+        self.contexts = _base_contexts if threading.current_thread() is threading.main_thread() else []
+
+_stack = _Stack()
 
 def current_context() -> Context:
-    return MemoizerContext._stack[-1]
+    contexts = _stack.contexts
+    return contexts[-1] if len(contexts) > 0 else _base_contexts[-1]
 
 def current_cache():
     return current_context().cache
@@ -15,20 +27,32 @@ def current_asof():
     return current_context().asof
 
 class MemoizerContext():
-    _stack = [_default_context]
-
-    def __init__(self, cache: AbstractCache = None, asof: datetime = None, render_html: bool = None, render_csv: bool = None):
+    """
+    With `max_staleness` set, a node missing for the current asof is served from the latest
+    earlier asof at most `max_staleness` old and recomputed in the background, see `wait_for_fresh`.
+
+    Contexts are entered per thread. Other threads use the context current in the main thread
+    until they enter one of their own, which then applies to that thread only.
+    """
+    def __init__(self, cache: AbstractCache = None, asof: datetime = None, render_html: bool = None, render_csv: bool = None, max_staleness: timedelta = None):
         assert isinstance(cache, AbstractCache) or cache is None
         assert type(asof) is datetime or asof is None
-        assert cache is not None or asof is not None
-        prev_cache, prev_asof, prev_render_html, prev_render_csv = current_context()
+        assert type(max_staleness) is timedelta or max_staleness is None
+        assert cache is not None or asof is not None or max_staleness is not None
+        prev_cache, prev_asof, prev_render_html, prev_render_csv, prev_max_staleness = current_context()
         self.cache = cache or prev_cache
         self.asof = asof or prev_asof
         self.render_html = render_html or prev_render_html
         self.render_csv = render_csv or prev_render_csv
+        self.max_staleness = max_staleness or prev_max_staleness
 
     def __enter__(self):
-        MemoizerContext._stack.append(Context(self.cache, self.asof, self.render_html, self.render_csv))
+        _stack.contexts.append(Context(self.cache, self.asof, self.render_html, self.render_csv, self.max_staleness))
 
     def __exit__(self, type, value, traceback):
-        MemoizerContext._stack.pop()
+        _stack.contexts.pop()
+
+class _ExactContext(MemoizerContext):
+    "enters `context` as it is, also where MemoizerContext would keep a previous value"
+    def __init__(self, context: Context):
+        self.cache, self.asof, self.render_html, self.render_csv, self.max_staleness = context
@@ -1,7 +1,10 @@
 import ast
 import hashlib
+import pickle
+import struct
+import sys
 from typing import Tuple, Callable, Dict, List
-from datetime import datetime
+from datetime import datetime, timedelta
 from urllib.parse import parse_qs, urlencode
 import os
 
@@ -12,9 +15,17 @@ _QUERYSTRING_MAX_LEN = 512
 is_windows = os.name == 'nt'
 
 class CallId:
+    """
+    Key of a call, independent of asof. The hash and the file name are computed at most once
+    per instance, so a CallId built once per memoized call can be reused for every lookup.
+    """
+    __slots__ = ('id', '_hash', '_fname')
+
     def __init__(self, _id: str):
         assert type(_id) is str
         self.id = _id
+        self._hash = hash(_id)
+        self._fname = None
 
     @staticmethod
     def from_call(f: Callable, *args, **kwargs):
@@ -24,7 +35,9 @@ class CallId:
         return _call_id_to_call(self.id)
     
     def to_fname(self) -> str:
-        return _call_id_to_fname(self.id)
+        if self._fname is None:
+            self._fname = _call_id_to_fname(self.id)
+        return self._fname
     
     def to_query_string(self) -> str:
         query_string = urlencode({'call': self.id})
@@ -43,15 +56,34 @@ class CallId:
         return f"{CallId.__name__}({repr(self.id)})"
     
     def __eq__(self, other):
-        return type(other) is type(self) and other.id == self.id
+        return type(other) is type(self) and other._hash == self._hash and other.id == self.id
     
     def __hash__(self):
-        return hash(self.id)
+        return self._hash
+
+    def __reduce__(self):
+        return (CallId, (self.id,))
+
+    def __setstate__(self, state):
+        # pickled before __slots__ was introduced
+        CallId.__init__(self, state['id'])
     
 class NodeId:
+    """
+    Key of a call at an asof, with string form `call@asof`. A NodeId built from a CallId and an
+    asof keeps both, one parsed from a string splits it on first use. Either way the string form
+    is the same, so cache paths and urls do not change.
+    """
+    __slots__ = ('id', '_hash', '_call_id', '_asof', '_asof_str', '_folder')
+
     def __init__(self, _id: str):
         assert type(_id) is str
         self.id = _id
+        self._hash = hash(_id)
+        self._call_id = None
+        self._asof = None
+        self._asof_str = None
+        self._folder = None
 
     @staticmethod
     def from_call(asof: datetime, f: Callable, *args, **kwargs):
@@ -61,7 +93,12 @@ class NodeId:
     def from_call_id_and_asof(call_id: CallId, asof: datetime):
         assert type(call_id) is CallId and type(asof) is datetime
         assert asof.tzinfo is None
-        return NodeId(f"{call_id.id}@{datetime_to_str(asof)}")
+        asof_str = datetime_to_str(asof)
+        node_id = NodeId(f"{call_id.id}@{asof_str}")
+        node_id._call_id = call_id
+        node_id._asof = asof
+        node_id._asof_str = asof_str
+        return node_id
     
     @staticmethod
     def from_query_string(query_string: str):
@@ -71,48 +108,189 @@ class NodeId:
         return NodeId.from_call_id_and_asof(call_id, asof)
     
     def to_query_string(self) -> str:
-        call_id, asof = self.to_call_id_and_asof()
-        query_string = urlencode({'call': call_id.id, 'asof': datetime_to_str(asof)})
+        call_id, _ = self.to_call_id_and_asof()
+        query_string = urlencode({'call': call_id.id, 'asof': self._asof_str})
         assert len(query_string) <= _QUERYSTRING_MAX_LEN
         return query_string
     
     def to_call_id_and_asof(self) -> Tuple[CallId, datetime]:
-        idx = self.id.rfind('@')
-        call_id = CallId(self.id[:idx])
-        asof = datetime_from_str(self.id[(idx+1):])
-        return (call_id, asof)
+        if self._call_id is None:
+            idx = self.id.rfind('@')
+            self._asof_str = self.id[(idx+1):]
+            self._asof = datetime_from_str(self._asof_str)
+            self._call_id = CallId(self.id[:idx])
+        return (self._call_id, self._asof)
+
+    def to_fname(self) -> str:
+        "file name of the node, unique within its asof folder"
+        return self.to_call_id_and_asof()[0].to_fname()
+
+    def to_folder(self) -> str:
+        "folder name of the node's asof"
+        if self._folder is None:
+            self.to_call_id_and_asof()
+            self._folder = self._asof_str.replace(":","-")
+        return self._folder
     
     def __str__(self):
         return self.id
     
     def __repr__(self):
-        return f"{NodeId.__name}({self.id})"
+        return f"{NodeId.__name__}({repr(self.id)})"
     
     def __eq__(self, other):
-        return type(other) is type(self) and self.id == other.id
+        return type(other) is type(self) and other._hash == self._hash and self.id == other.id
     
     def __hash__(self):
-        return hash(self.id)
+        return self._hash
+
+    def __reduce__(self):
+        return (NodeId, (self.id,))
+
+    def __setstate__(self, state):
+        # pickled before __slots__ was introduced
+        NodeId.__init__(self, state['id'])
     
+class Html:
+    def __init__(self, string):
+        self.string = string
+    
+    def __str__(self):
+        return self.string
+
 def assert_type(o, t):
     assert type(o) is t, [o, type(o), t]
     return o
 
 class Metadata:
+    """
+    Metadata of an evaluated node. Kept compact because the web UI and profiling hold it for
+    every node: the call id is derived from the node id on access, args and kwargs are kept as
+    one pickle, children as id strings, and the source text is shared between all nodes of a
+    function through a side table keyed by its hash. `encode`/`decode` is a versioned binary
+    layout, also used when pickling.
+    """
+    __slots__ = ('node_id', 'asof', 'module', 'function', '_args_kwargs', '_children', 'start_time', 'end_time', 'cpu_time_sec', '_source_hash', 'return_type', 'stale')
+
     def __init__(self, node_id: NodeId, call_id: CallId, asof: datetime, module: str, function: str, args: Tuple, kwargs: Dict, children: List[NodeId], start_time: datetime, end_time: datetime, cpu_time_sec: float, source: str, return_type: str):
+        assert_type(call_id, CallId)
+        assert_type(args, tuple)
+        assert_type(kwargs, dict)
         self.node_id: NodeId = assert_type(node_id, NodeId)
-        self.call_id: CallId = assert_type(call_id, CallId)
         self.asof: datetime = assert_type(asof, datetime)
-        self.module: str = assert_type(module, str)
-        self.function: str = assert_type(function, str)
-        self.args: Tuple = assert_type(args, tuple)
-        self.kwargs: Dict = assert_type(kwargs, dict)
-        self.children: List[NodeId] = assert_type(children, list)
+        self.module: str = sys.intern(assert_type(module, str))
+        self.function: str = sys.intern(assert_type(function, str))
+        self._args_kwargs: bytes = pickle.dumps((args, kwargs), protocol=pickle.HIGHEST_PROTOCOL)
+        self._children: Tuple[str] = tuple(assert_type(child, NodeId).id for child in assert_type(children, list))
         self.start_time: datetime = assert_type(start_time, datetime)
         self.end_time: datetime = assert_type(end_time, datetime)
         self.cpu_time_sec: float = assert_type(cpu_time_sec, float)
-        self.source: str = assert_type(source, str)
-        self.return_type: str = assert_type(return_type, str)
+        self._source_hash: bytes = _intern_source(assert_type(source, str))
+        self.return_type: str = sys.intern(assert_type(return_type, str))
+        self.stale: bool = False # set on a copy when it is served for a later asof, not persisted
+        assert self.call_id == call_id, [self.call_id, call_id]
+
+    @property
+    def call_id(self) -> CallId:
+        return CallId(self.node_id.id[:self.node_id.id.rfind('@')])
+
+    @property
+    def args(self) -> Tuple:
+        return self._load_args_kwargs()[0]
+
+    @property
+    def kwargs(self) -> Dict:
+        return self._load_args_kwargs()[1]
+
+    def _load_args_kwargs(self) -> Tuple[Tuple, Dict]:
+        if self._args_kwargs is None:
+            # decoded from version 1, which did not keep them: parse the call id, which loses
+            # the difference between a one element tuple and its element
+            return _call_id_to_args_kwargs(self.call_id.id)
+        return pickle.loads(self._args_kwargs)
+
+    @property
+    def children(self) -> List[NodeId]:
+        return [NodeId(_id) for _id in self._children]
+
+    @property
+    def source(self) -> str:
+        return _sources[self._source_hash]
+
+    def encode(self) -> bytes:
+        strings = [self.node_id.id, self.module, self.function, self.return_type, self.source]
+        args_kwargs = self._args_kwargs if self._args_kwargs is not None else pickle.dumps(self._load_args_kwargs(), protocol=pickle.HIGHEST_PROTOCOL)
+        encoded = [s.encode('utf-8') for s in strings] + [args_kwargs] + [child.encode('utf-8') for child in self._children]
+        header = _METADATA_HEADER.pack(_METADATA_MAGIC, _METADATA_VERSION, *_datetime_to_ints(self.asof), *_datetime_to_ints(self.start_time), *_datetime_to_ints(self.end_time), self.cpu_time_sec, self._source_hash, len(encoded))
+        return header + struct.pack(f'<{len(encoded)}I', *(len(b) for b in encoded)) + b''.join(encoded)
+
+    @staticmethod
+    def decode(buffer: bytes) -> 'Metadata':
+        magic, version, *fields = _METADATA_HEADER.unpack_from(buffer)
+        assert magic == _METADATA_MAGIC, magic
+        assert version in (1, _METADATA_VERSION), f'unsupported metadata version {version}'
+        asof_days, asof_us, start_days, start_us, end_days, end_us, cpu_time_sec, source_hash, n = fields
+        offset = _METADATA_HEADER.size
+        lengths = struct.unpack_from(f'<{n}I', buffer, offset)
+        offset += 4 * n
+        strings = []
+        args_kwargs = None
+        for i, length in enumerate(lengths):
+            if i == 4 and source_hash in _sources:
+                strings.append(None) # source text is already in the side table, no need to decode it
+            elif i == 5 and version >= 2:
+                args_kwargs = bytes(buffer[offset:(offset+length)])
+            else:
+                strings.append(buffer[offset:(offset+length)].decode('utf-8'))
+            offset += length
+        node_id, module, function, return_type, source = strings[:5]
+        if source is not None:
+            _sources.setdefault(source_hash, source)
+        metadata = Metadata.__new__(Metadata)
+        metadata.node_id = NodeId(node_id)
+        metadata.asof = _datetime_from_ints(asof_days, asof_us)
+        metadata.module = sys.intern(module)
+        metadata.function = sys.intern(function)
+        metadata._args_kwargs = args_kwargs
+        metadata._children = tuple(strings[5:])
+        metadata.start_time = _datetime_from_ints(start_days, start_us)
+        metadata.end_time = _datetime_from_ints(end_days, end_us)
+        metadata.cpu_time_sec = cpu_time_sec
+        metadata._source_hash = source_hash
+        metadata.return_type = sys.intern(return_type)
+        metadata.stale = False
+        return metadata
+
+    def as_stale(self) -> 'Metadata':
+        metadata = Metadata.decode(self.encode())
+        metadata.stale = True
+        return metadata
+
+    def __reduce__(self):
+        return (Metadata.decode, (self.encode(),))
+
+    def __setstate__(self, state):
+        # metadata pickled before __slots__ was introduced
+        Metadata.__init__(self, **state)
+
+_METADATA_MAGIC = b'MDAT'
+_METADATA_VERSION = 2 # 2 added the pickled args and kwargs, as the string after the source
+# magic, version, asof, start_time, end_time as (ordinal day, microsecond of day), cpu_time_sec, source hash, number of strings
+_METADATA_HEADER = struct.Struct('<4sBiqiqiqd16sI')
+
+_sources: Dict[bytes, str] = {}
+
+def _intern_source(source: str) -> bytes:
+    source_hash = sha256(source.encode('utf-8'))[:16]
+    _sources.setdefault(source_hash, source)
+    return source_hash
+
+def _datetime_to_ints(dt: datetime) -> Tuple[int, int]:
+    assert dt.tzinfo is None
+    return dt.toordinal(), ((dt.hour * 60 + dt.minute) * 60 + dt.second) * 1000000 + dt.microsecond
+
+def _datetime_from_ints(days: int, us: int) -> datetime:
+    return datetime.fromordinal(days) + timedelta(microseconds=us)
 
 _datetime_fmt_ymd = lambda fmty04: f'%{"04" if fmty04 else ""}Y-%m-%d'
 _datetime_fmt_ymdhms = lambda fmty04: _datetime_fmt_ymd(fmty04) + ' %H:%M:%S'
@@ -134,8 +312,13 @@ def _call_to_id(f: Callable, *args, **kwargs) -> str:
     return f"{_f_to_str(f)}{_args_to_str(args, kwargs)}"
 
 def _call_id_to_call(s: str) -> Tuple[Callable, Tuple, Dict]:
-    module_name, func_name, args_kwargs_str = _split_to_module_func_argskwargs(s)
+    module_name, func_name, _ = _split_to_module_func_argskwargs(s)
     f = _str_to_f(module_name, func_name)
+    args, kwargs = _call_id_to_args_kwargs(s)
+    return f, args, kwargs
+
+def _call_id_to_args_kwargs(s: str) -> Tuple[Tuple, Dict]:
+    _, func_name, args_kwargs_str = _split_to_module_func_argskwargs(s)
     s = func_name + args_kwargs_str
     tree = ast.parse(s)
     assert type(tree) is ast.Module
@@ -147,7 +330,7 @@ def _call_id_to_call(s: str) -> Tuple[Callable, Tuple, Dict]:
     assert type(call) is ast.Call, ast.dump(call)
     args = _parse_args(call.args)
     kwargs = _parse_kwargs(call.keywords)
-    return f, args, kwargs
+    return args, kwargs
 
 def _call_id_to_fname(s: str):
     from urllib.parse import quote
@@ -1,28 +1,20 @@
 import html
 import os
 import re
-from urllib.parse import quote
-import pandas as pd
-from .core import NodeId, Metadata
+import sys
+from functools import lru_cache
+from .core import NodeId, Metadata, Html
 from typing import Any, Callable
 
-class Html:
-    def __init__(self, string):
-        self.string = string
-    
-    def __str__(self):
-        return self.string
-
-def _read_default_css():
+@lru_cache
+def default_css() -> str:
     pandas_csv_path = os.path.join(os.path.dirname(__file__), 'styles', 'default.css')
     with open(pandas_csv_path, 'r') as file:
         return file.read()
-    
-default_css = _read_default_css()
 
 def render_html(res: Any, metadata: Metadata, href_eval: Callable[[NodeId], str], href_download_csv: Callable[[NodeId], str]) -> str:
     if type(res) is Html:
-        res = _inject_details(str(res), _details_html(metadata, href_eval))
+        res = _inject_details(str(res), _stale_html(metadata) + _details_html(metadata, href_eval))
         return res
     else:
         return f"""
@@ -30,10 +22,11 @@ def render_html(res: Any, metadata: Metadata, href_eval: Callable[[NodeId], str]
         <head>
             <title>{metadata.node_id.id}</title>
             <style type='text/css'>
-            {default_css}
+            {default_css()}
             </style>
         </head>
         <body>
+        {_stale_html(metadata)}
         {_obj_to_html(res, metadata.node_id, href_download_csv)}
         {_details_html(metadata, href_eval)}
         </body></html>
@@ -47,6 +40,10 @@ def _inject_details(html, details_html):
             needs_to_append += tag
     return html + details_html + ''.join(needs_to_append)
 
+def _stale_html(metadata: Metadata) -> str:
+    if not metadata.stale: return ''
+    return f'<div style="background:#fff3cd;border:1px solid #e0c36c;padding:4px;">stale result as of {metadata.asof.isoformat()}, being recomputed</div>'
+
 def _details_html(metadata: Metadata, href_eval: Callable[[NodeId], str]):
     return f"""
     <div id=details_toggle style="cursor:pointer;position:fixed;bottom:0;right:0;font-size:50%;border:1px solid gray;">memoizer details</div>
@@ -88,6 +85,7 @@ def _details_content_html(metadata: Metadata, href_eval: Callable[[NodeId], str]
         <h3>Memoizer</h3>
         <table>
         <tr><td>node id</td><td><code>{metadata.node_id.id}</code></td></tr>
+        {'<tr><td>stale</td><td><code>as of ' + metadata.asof.isoformat() + '</code></td></tr>' if metadata.stale else ''}
         <tr><td>return type</td><td><code>{metadata.return_type}</code></td></tr>
         <tr><td>source</td><td><div><pre><code class="python" style="position: relative; top: -4px; padding: 0px">{html.escape(metadata.source)}</code></pre></div></td></tr>
         {'' if len(metadata.children)==0 else '<tr><td>children</td><td>' + '<br>'.join(['<code><a href="'+href_eval(_id)+'#details" target="_top">'+_id.id+'</a></code>' for _id in metadata.children]) + '</td></tr>'}
@@ -103,10 +101,11 @@ def _obj_to_html(obj, node_id: NodeId, href_download_csv: Callable[[NodeId], str
     assert type(node_id) is NodeId
     res = f"<div><code><pre>{node_id.id}</pre></code></div>"
     assert type(obj) is not Html
+    pd = sys.modules.get('pandas') # a Series or DataFrame result implies pandas has already been imported
     pd_max_rows = 10000
-    if type(obj) is pd.Series:
+    if pd is not None and type(obj) is pd.Series:
         obj = obj.to_frame()
-    if type(obj) is pd.DataFrame:
+    if pd is not None and type(obj) is pd.DataFrame:
         res += f'<div>{len(obj)} total rows'
         if len(obj) > pd_max_rows:
             res += f', only showing the top {pd_max_rows} rows'
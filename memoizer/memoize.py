@@ -1,16 +1,37 @@
 from datetime import datetime
 from time import time
-from memoizer.context import current_context
+from datetime import timedelta
+import re
+from memoizer.context import current_context, _ExactContext
 from memoizer.core import NodeId, CallId, Metadata, _is_memoized, _get_wrapped, _set_wrapped
-from memoizer.caches import FileCache
+from memoizer.caches import AbstractCache, FileCache
 import inspect
-from typing import Callable
+import threading
+from typing import Callable, Union
 from functools import lru_cache
 
-_children_stack = [set()]
-_selftimes_stack = [[]]
+class _Stacks(threading.local):
+    def __init__(self):
+        self.children = [set()]
+        self.selftimes = [[]]
+        self.stale = [False] # whether a node being evaluated has used a stale result
 
-def memoize(f):
+_stacks = _Stacks()
+_revalidating = {}
+_revalidating_lock = threading.Lock()
+_asof_buckets = {}
+
+def memoize(f: Callable = None, valid_for: Union[str, Callable[[datetime], datetime]] = None):
+    """
+    `valid_for` declares that a result stays valid for a range of asofs: 'year', 'month', 'week', 'day',
+    a number of days, hours, minutes or seconds such as '1D', '4H', '15min', '30s', or a function
+    mapping an asof to the start of its range. The node is then keyed by, and evaluated at, the start
+    of the range of the current asof, so all asofs in a range share one result.
+    """
+    if f is None:
+        return lambda f: memoize(f, valid_for)
+    if valid_for is not None:
+        _asof_buckets[f] = _asof_bucket(valid_for)
     def memoized(*args, **kwargs):
         assert not _is_memoized(f)
         return _eval_cached(f, *args, **kwargs)
@@ -18,8 +39,8 @@ def memoize(f):
     return memoized
 
 def blow_cache(memoized: Callable, *args, **kwargs):
-    asof = current_context().asof
     f = _get_wrapped(memoized)
+    asof = _node_asof(f, current_context().asof)
     node_id = NodeId.from_call(asof, f, *args, **kwargs)
     cache = current_context().cache
     if cache.contains(node_id):
@@ -27,53 +48,162 @@ def blow_cache(memoized: Callable, *args, **kwargs):
 
 def node_fname(f: Callable, *args, **kwargs) -> str:
     cache = current_context().cache
-    asof = current_context().asof
+    asof = _node_asof(_get_wrapped(f) if _is_memoized(f) else f, current_context().asof)
     call_id = CallId.from_call(f, *args, **kwargs)
     node_id = NodeId.from_call_id_and_asof(call_id, asof)
     assert type(cache) is FileCache
     return _href_eval(cache, node_id)
 
+def wait_for_fresh(memoized: Callable, *args, **kwargs):
+    "returns the result for the current asof, waiting for its recomputation if a stale result was served for it"
+    f = _get_wrapped(memoized)
+    node_id = NodeId.from_call(_node_asof(f, current_context().asof), f, *args, **kwargs)
+    with _revalidating_lock:
+        future = _revalidating.get(node_id)
+    if future is not None:
+        future.result()
+    with _ExactContext(current_context()._replace(max_staleness=None)):
+        return _eval_cached(f, *args, **kwargs)
+
 def _eval_cached(f, *args, **kwargs):
+    asof = current_context().asof
+    node_asof = _node_asof(f, asof)
+    if node_asof != asof:
+        # evaluate at the start of the validity range, so that children are consistent with the node
+        with _ExactContext(current_context()._replace(asof=node_asof)):
+            return _eval_cached_in_context(f, *args, **kwargs)
+    return _eval_cached_in_context(f, *args, **kwargs)
+
+def _eval_cached_in_context(f, *args, **kwargs):
     cache = current_context().cache
     asof = current_context().asof
+    max_staleness = current_context().max_staleness
     call_id = CallId.from_call(f, *args, **kwargs)
     node_id = NodeId.from_call_id_and_asof(call_id, asof)
-    _children_stack[-1].add(node_id)
-    if not cache.contains(node_id):
-        _children_stack.append(set())
-        _selftimes_stack.append([])
-
-        # TODO pass in loglevel from context
-        logger().info(f"eval {node_id.id}")
-        res, start_time, end_time = _eval(f, *args, **kwargs)
-        wall_time = end_time - start_time
-        logger().info(f"done {node_id.id} in {wall_time}")
-
-        cpu_time_sec = wall_time - sum(el[3] for el in _selftimes_stack.pop())
-        children = _children_stack.pop()
-        _selftimes_stack[-1].append((node_id, start_time, end_time, wall_time))
-        metadata = Metadata(
-            node_id,
-            call_id,
-            asof,
-            f.__module__,
-            f.__name__,
-            args,
-            kwargs,
-            list(children),
-            datetime.fromtimestamp(start_time),
-            datetime.fromtimestamp(end_time),
-            cpu_time_sec,
-            ''.join(inspect.getsourcelines(f)[0]),
-            type(res).__name__
-        )
-        cache.write(node_id, res, metadata)
-        if current_context().render_html:
-            _render_html(cache, node_id, res, metadata)
-        if current_context().render_csv:
-            _render_csv(cache, node_id, res, metadata)
+    _stacks.children[-1].add(node_id)
+    if cache.contains(node_id):
+        try:
+            return cache.read_result(node_id)
+        except (KeyError, FileNotFoundError):
+            pass # removed since, e.g. evicted by another process sharing the cache: evaluate it again
+    if max_staleness is not None:
+        stale_node_id = _latest_earlier_node_id(cache, call_id, asof, max_staleness)
+        if stale_node_id is not None:
+            try:
+                stale_res = cache.read_result(stale_node_id)
+            except (KeyError, FileNotFoundError):
+                stale_node_id = None
+        if stale_node_id is not None:
+            logger().info(f"stale {node_id.id} from {stale_node_id.id}")
+            _stacks.stale[-1] = True
+            _revalidate(node_id, f, args, kwargs)
+            return stale_res
+
+    _stacks.children.append(set())
+    _stacks.selftimes.append([])
+    _stacks.stale.append(False)
+
+    # TODO pass in loglevel from context
+    logger().info(f"eval {node_id.id}")
+    res, start_time, end_time = _eval(f, *args, **kwargs)
+    wall_time = end_time - start_time
+    logger().info(f"done {node_id.id} in {wall_time}")
+
+    cpu_time_sec = wall_time - sum(el[3] for el in _stacks.selftimes.pop())
+    children = _stacks.children.pop()
+    _stacks.selftimes[-1].append((node_id, start_time, end_time, wall_time))
+    if _stacks.stale.pop():
+        # computed from stale results, so it is stale itself: not cached but recomputed in the background
+        _stacks.stale[-1] = True
+        _revalidate(node_id, f, args, kwargs)
         return res
-    return cache.read_result(node_id)
+    metadata = Metadata(
+        node_id,
+        call_id,
+        asof,
+        f.__module__,
+        f.__name__,
+        args,
+        kwargs,
+        list(children),
+        datetime.fromtimestamp(start_time),
+        datetime.fromtimestamp(end_time),
+        cpu_time_sec,
+        ''.join(inspect.getsourcelines(f)[0]),
+        type(res).__name__
+    )
+    cache.write(node_id, res, metadata)
+    if current_context().render_html:
+        _render_html(cache, node_id, res, metadata)
+    if current_context().render_csv:
+        _render_csv(cache, node_id, res, metadata)
+    return res
+
+def _node_asof(f, asof: datetime) -> datetime:
+    "the asof a call of the (not memoized) function `f` is keyed by when evaluated at `asof`"
+    bucket = _asof_buckets.get(f)
+    return bucket(asof) if bucket is not None else asof
+
+def _bucketed_node_id(node_id: NodeId) -> NodeId:
+    "the node a request for `node_id` is served from, given the validity declared for its function"
+    call_id, asof = node_id.to_call_id_and_asof()
+    f, _, _ = call_id.to_call()
+    node_asof = _node_asof(_get_wrapped(f) if _is_memoized(f) else f, asof)
+    return node_id if node_asof == asof else NodeId.from_call_id_and_asof(call_id, node_asof)
+
+_BUCKETS = {
+    'year': lambda asof: datetime(asof.year, 1, 1),
+    'month': lambda asof: datetime(asof.year, asof.month, 1),
+    'week': lambda asof: datetime.combine(asof.date() - timedelta(days=asof.weekday()), datetime.min.time()),
+    'day': lambda asof: datetime.combine(asof.date(), datetime.min.time()),
+}
+_BUCKET_UNITS_SEC = {'D': 86400, 'H': 3600, 'min': 60, 's': 1}
+
+def _asof_bucket(valid_for: Union[str, Callable[[datetime], datetime]]) -> Callable[[datetime], datetime]:
+    if callable(valid_for):
+        return valid_for
+    if valid_for in _BUCKETS:
+        return _BUCKETS[valid_for]
+    match = re.fullmatch(r'(\d*)(D|H|min|s)', valid_for)
+    n = int(match.group(1) or 1) if match is not None else 0
+    if n == 0:
+        raise Exception(f'unrecognised valid_for: {valid_for}')
+    step_sec = n * _BUCKET_UNITS_SEC[match.group(2)]
+    def bucket(asof: datetime) -> datetime:
+        # ranges are counted from 0001-01-01, so that they do not depend on the timezone or the epoch
+        sec = (asof.toordinal() - 1) * 86400 + asof.hour * 3600 + asof.minute * 60 + asof.second
+        return datetime.min + timedelta(seconds=sec - sec % step_sec)
+    return bucket
+
+def _latest_earlier_node_id(cache: AbstractCache, call_id: CallId, asof: datetime, max_staleness: timedelta) -> Union[NodeId, None]:
+    latest = cache.get_latest_node_id_by_call_id(call_id)
+    if latest is not None and latest.to_call_id_and_asof()[1] >= asof:
+        earlier = [node_id for node_id in cache.list_node_ids_by_call_id(call_id) if node_id.to_call_id_and_asof()[1] < asof]
+        latest = max(earlier, key=lambda node_id: node_id.to_call_id_and_asof()[1], default=None)
+    if latest is None or asof - latest.to_call_id_and_asof()[1] > max_staleness:
+        return None
+    return latest
+
+def _revalidate(node_id: NodeId, f, args, kwargs):
+    context = current_context()._replace(max_staleness=None)
+    with _revalidating_lock:
+        if node_id not in _revalidating:
+            _revalidating[node_id] = _revalidation_executor().submit(_revalidate_in_background, context, node_id, f, args, kwargs)
+
+def _revalidate_in_background(context, node_id: NodeId, f, args, kwargs):
+    try:
+        with _ExactContext(context):
+            if not context.cache.contains(node_id):
+                _eval_cached(f, *args, **kwargs)
+    finally:
+        with _revalidating_lock:
+            del _revalidating[node_id]
+
+@lru_cache
+def _revalidation_executor():
+    # a single thread, to not compete with the foreground for the cache and the interpreter
+    from concurrent.futures import ThreadPoolExecutor
+    return ThreadPoolExecutor(max_workers=1, thread_name_prefix='memoizer-revalidate')
 
 def _href_eval(cache: FileCache, node_id: NodeId):
     fname = cache._fname(node_id, ".html")
@@ -92,10 +222,11 @@ def _render_html(cache, node_id, res, metadata):
     write_file(fname, html.encode('utf-8'))
 
 def _render_csv(cache, node_id, res, metadata):
-    from .caches import FileCache, write_file
-    import pandas as pd
+    import sys
+    pd = sys.modules.get('pandas') # a DataFrame result implies pandas has already been imported
+    if type(cache) is not FileCache or pd is None or type(res) is not pd.DataFrame: return
+    from .caches import write_file
     from .web import handle_download_csv
-    if type(cache) is not FileCache or type(res) is not pd.DataFrame: return
     _, bytes_io = handle_download_csv(cache, node_id)
     content = bytes_io.getvalue()
     write_file(cache._fname(node_id, ".csv"), content)
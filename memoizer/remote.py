@@ -0,0 +1,331 @@
+from typing import Iterable, List, Tuple, Union
+from threading import Lock
+import hashlib
+import hmac
+import os
+import pickle
+import socket
+import struct
+from memoizer.caches import AbstractCache
+from memoizer.core import NodeId, CallId, Metadata, is_windows
+
+# A message is an op or status byte and a number of parts, each part is its length and its bytes.
+# Results travel as a protocol 5 pickle followed by its out-of-band buffers, each its own part, so
+# large arrays are not copied into the pickle or into one message. Parts are sent and received in
+# 1 MiB chunks straight from and into their buffers. This is not streaming: the cache API takes and
+# returns whole objects, so a result is fully pickled before it is sent, every part of a message is
+# received into memory before it is used, and a read_results response holds its whole batch in the
+# server's memory. Peak memory is about twice the size of the results in flight, on either side.
+# A connection serves requests in order, so a client can pipeline them.
+# A pipelining client keeps at most _PIPELINE_DEPTH requests unanswered: the server answers each
+# request before reading the next, so responses left unread would fill the socket buffers and
+# both sides would block sending.
+_MESSAGE_HEADER = struct.Struct('<BI')
+_PART_HEADER = struct.Struct('<Q')
+_CHUNK_SIZE = 1 << 20
+_PIPELINE_DEPTH = 64
+
+# A connection starts with the server sending a hello. With a token it is a random challenge
+# that the client answers with its HMAC under the token, before the server reads any request:
+# results are pickles, and unpickling runs code, so only clients holding the token may send them.
+_CHALLENGE_SIZE = 32
+_AUTH_MAX_LENGTH = 64
+
+_WRITE, _READ_RESULT, _READ_METADATA, _CONTAINS, _REMOVE, _LIST_NODE_IDS, _LIST_NODE_IDS_BY_CALL_ID, _GET_LATEST_NODE_ID_BY_CALL_ID, _READ_RESULTS, _AUTH = range(10)
+_OK, _MISSING, _ERROR, _CHALLENGE = range(4)
+
+class RemoteCache(AbstractCache):
+    """
+    Client of a cache server, see `serve`. `address` is a (host, port) tuple or the path of a unix socket,
+    `token` the secret the server was started with. Up to `max_connections` connections are kept open
+    and shared by threads. `contains_many` and `read_results` answer many nodes in one round trip and
+    `write_many` pipelines its writes. Results are held whole in memory on both sides while they are
+    sent, batches of `read_results` too, so split very large batches. Results read are unpickled,
+    so only connect to trusted servers.
+    """
+    def __init__(self, address: Union[Tuple[str, int], str], max_connections: int = 8, token: bytes = None) -> None:
+        assert token is None or type(token) is bytes
+        self.address = address
+        self.max_connections = max_connections
+        self.token = token
+        self._idle = []
+        self._lock = Lock()
+
+    def __getstate__(self):
+        return {'address': self.address, 'max_connections': self.max_connections, 'token': self.token}
+
+    def __setstate__(self, state):
+        self.__init__(state['address'], state['max_connections'], state.get('token'))
+
+    def write(self, node_id: NodeId, result: object, metadata: Metadata) -> None:
+        self.write_many([(node_id, result, metadata)])
+
+    def write_many(self, items: Iterable[Tuple[NodeId, object, Metadata]]) -> None:
+        requests = ((_WRITE, [_id_bytes(node_id), metadata.encode()] + _dump_result(result)) for node_id, result, metadata in items)
+        for _ in self._pipeline(requests):
+            pass
+
+    def read_result(self, node_id: NodeId) -> object:
+        return _load_result(self._request(_READ_RESULT, [_id_bytes(node_id)], node_id))
+
+    def read_results(self, node_ids: List[NodeId]) -> List[object]:
+        "reads many results in one round trip, raises KeyError if any of them is missing"
+        parts = self._request(_READ_RESULTS, [_id_bytes(node_id) for node_id in node_ids])
+        results = []
+        i = 0
+        for node_id in node_ids:
+            (n,) = _PART_HEADER.unpack(parts[i])
+            if n == 0: raise KeyError(node_id.id)
+            results.append(_load_result(parts[(i + 1):(i + 1 + n)]))
+            i += 1 + n
+        return results
+
+    def read_metadata(self, node_id: NodeId) -> Metadata:
+        return Metadata.decode(self._request(_READ_METADATA, [_id_bytes(node_id)], node_id)[0])
+
+    def contains(self, node_id: NodeId) -> bool:
+        return self.contains_many([node_id])[0]
+
+    def contains_many(self, node_ids: List[NodeId]) -> List[bool]:
+        "checks many nodes in one round trip"
+        return [flag == 1 for flag in self._request(_CONTAINS, [_id_bytes(node_id) for node_id in node_ids])[0]]
+
+    def remove(self, node_id: NodeId) -> None:
+        self._request(_REMOVE, [_id_bytes(node_id)], node_id)
+
+    def list_node_ids(self) -> List[NodeId]:
+        return [NodeId(part.decode('utf-8')) for part in self._request(_LIST_NODE_IDS, [])]
+
+    def list_node_ids_by_call_id(self, call_id: CallId) -> List[NodeId]:
+        return [NodeId(part.decode('utf-8')) for part in self._request(_LIST_NODE_IDS_BY_CALL_ID, [_id_bytes(call_id)])]
+
+    def get_latest_node_id_by_call_id(self, call_id: CallId) -> Union[NodeId, None]:
+        parts = self._request(_GET_LATEST_NODE_ID_BY_CALL_ID, [_id_bytes(call_id)])
+        return NodeId(parts[0].decode('utf-8')) if len(parts) > 0 else None
+
+    def close(self) -> None:
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for sock in idle:
+            sock.close()
+
+    def _request(self, op: int, parts: List[bytes], node_id: NodeId = None) -> List[bytearray]:
+        return next(iter(self._pipeline([(op, parts)], node_id)))
+
+    def _pipeline(self, requests: Iterable[Tuple[int, List[bytes]]], node_id: NodeId = None):
+        "sends requests up to _PIPELINE_DEPTH ahead of reading their responses, yields the parts of each response in order"
+        sock = self._acquire()
+        responses = []
+        sent = 0
+        try:
+            for op, parts in requests:
+                _send_message(sock, op, parts)
+                sent += 1
+                if sent - len(responses) > _PIPELINE_DEPTH:
+                    responses.append(_recv_message(sock))
+            while len(responses) < sent:
+                responses.append(_recv_message(sock))
+        except BaseException:
+            sock.close() # the connection is in an unknown state
+            raise
+        self._release(sock)
+        for status, parts in responses:
+            if status == _MISSING: raise KeyError(node_id.id if node_id is not None else None)
+            if status == _ERROR: raise Exception(f'cache server error: {parts[0].decode("utf-8")}')
+            yield parts
+
+    def _acquire(self) -> socket.socket:
+        with self._lock:
+            if len(self._idle) > 0:
+                return self._idle.pop()
+        if type(self.address) is str:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        else:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        try:
+            sock.connect(self.address)
+            status, parts = _recv_message(sock) # hello
+            if status == _CHALLENGE:
+                if self.token is None: raise PermissionError(f'cache server at {self.address} requires a token')
+                _send_message(sock, _AUTH, [_authenticate(self.token, parts[0])])
+        except BaseException:
+            sock.close()
+            raise
+        return sock
+
+    def _release(self, sock: socket.socket) -> None:
+        with self._lock:
+            if len(self._idle) < self.max_connections:
+                self._idle.append(sock)
+                return
+        sock.close()
+
+def serve(cache: AbstractCache, address: Union[Tuple[str, int], str], token: bytes = None):
+    """
+    Creates a server exposing `cache` to RemoteCache clients on a (host, port) tuple or a unix socket path,
+    each connection is served by its own thread. Call `serve_forever()` on the result to run it.
+    Calls into `cache` are serialized, sending and receiving results is not.
+
+    SECURITY: results written by clients are unpickled by the server, and unpickling can run arbitrary
+    code, so whoever can send requests can run code as the server. A server on a (host, port) therefore
+    requires a `token`, a secret shared with its clients, who must prove they hold it before any request
+    is read. Traffic is not encrypted, so only use it on trusted networks. A unix socket is protected by
+    its file permissions and needs no token.
+    """
+    import socketserver
+    assert token is None or type(token) is bytes
+    assert token is not None or type(address) is str, 'a server on a (host, port) needs a token, see the security note'
+    lock = Lock()
+
+    class Handler(socketserver.BaseRequestHandler):
+        def handle(self):
+            try:
+                if token is None:
+                    _send_message(self.request, _OK, [])
+                else:
+                    challenge = os.urandom(_CHALLENGE_SIZE)
+                    _send_message(self.request, _CHALLENGE, [challenge])
+                    op, parts = _recv_message(self.request, max_length=_AUTH_MAX_LENGTH)
+                    if op != _AUTH or len(parts) != 1 or not hmac.compare_digest(bytes(parts[0]), _authenticate(token, challenge)):
+                        return # closes the connection without reading any request
+            except ConnectionError:
+                return
+            while True:
+                try:
+                    op, parts = _recv_message(self.request)
+                except ConnectionError:
+                    return
+                try:
+                    status, parts = _handle(cache, lock, op, parts)
+                except (KeyError, FileNotFoundError):
+                    status, parts = _MISSING, []
+                except Exception as e:
+                    status, parts = _ERROR, [repr(e).encode('utf-8')]
+                _send_message(self.request, status, parts)
+
+    base = socketserver.ThreadingUnixStreamServer if type(address) is str else socketserver.ThreadingTCPServer
+
+    class Server(base):
+        allow_reuse_address = True
+        daemon_threads = True
+
+    return Server(address, Handler)
+
+def _handle(cache: AbstractCache, lock: Lock, op: int, parts: List[bytearray]) -> Tuple[int, List[bytes]]:
+    if op == _WRITE:
+        node_id = NodeId(parts[0].decode('utf-8'))
+        metadata = Metadata.decode(parts[1])
+        result = _load_result(parts[2:])
+        with lock:
+            cache.write(node_id, result, metadata)
+        return _OK, []
+    if op == _READ_RESULT:
+        node_id = NodeId(parts[0].decode('utf-8'))
+        with lock:
+            result = cache.read_result(node_id)
+        return _OK, _dump_result(result)
+    if op == _READ_RESULTS:
+        response = []
+        for part in parts:
+            node_id = NodeId(part.decode('utf-8'))
+            with lock:
+                result_parts = _dump_result(cache.read_result(node_id)) if cache.contains(node_id) else []
+            response += [_PART_HEADER.pack(len(result_parts))] + result_parts
+        return _OK, response
+    if op == _READ_METADATA:
+        node_id = NodeId(parts[0].decode('utf-8'))
+        with lock:
+            metadata = cache.read_metadata(node_id)
+        return _OK, [metadata.encode()]
+    if op == _CONTAINS:
+        with lock:
+            flags = bytes(cache.contains(NodeId(part.decode('utf-8'))) for part in parts)
+        return _OK, [flags]
+    if op == _REMOVE:
+        with lock:
+            cache.remove(NodeId(parts[0].decode('utf-8')))
+        return _OK, []
+    if op == _LIST_NODE_IDS:
+        with lock:
+            node_ids = cache.list_node_ids()
+        return _OK, [_id_bytes(node_id) for node_id in node_ids]
+    if op == _LIST_NODE_IDS_BY_CALL_ID:
+        with lock:
+            node_ids = cache.list_node_ids_by_call_id(CallId(parts[0].decode('utf-8')))
+        return _OK, [_id_bytes(node_id) for node_id in node_ids]
+    if op == _GET_LATEST_NODE_ID_BY_CALL_ID:
+        with lock:
+            node_id = cache.get_latest_node_id_by_call_id(CallId(parts[0].decode('utf-8')))
+        return _OK, [_id_bytes(node_id)] if node_id is not None else []
+    raise Exception(f'unknown op {op}')
+
+def _authenticate(token: bytes, challenge: bytes) -> bytes:
+    return hmac.new(token, bytes(challenge), hashlib.sha256).digest()
+
+def _id_bytes(_id: Union[NodeId, CallId]) -> bytes:
+    assert type(_id) in (NodeId, CallId)
+    return _id.id.encode('utf-8')
+
+def _dump_result(result: object) -> List[bytes]:
+    buffers = []
+    result_bytes = pickle.dumps(result, protocol=5, buffer_callback=buffers.append)
+    return [result_bytes] + [buffer.raw() for buffer in buffers]
+
+def _load_result(parts: List[bytearray]) -> object:
+    return pickle.loads(parts[0], buffers=parts[1:])
+
+def _send_message(sock: socket.socket, op: int, parts: List[bytes]) -> None:
+    sock.sendall(_MESSAGE_HEADER.pack(op, len(parts)))
+    for part in parts:
+        view = memoryview(part).cast('B')
+        sock.sendall(_PART_HEADER.pack(len(view)))
+        for i in range(0, len(view), _CHUNK_SIZE):
+            sock.sendall(view[i:(i + _CHUNK_SIZE)])
+
+def _recv_message(sock: socket.socket, max_length: int = None) -> Tuple[int, List[bytearray]]:
+    "with `max_length`, a message of more than one part or a longer part closes the connection, e.g. from unauthenticated peers"
+    op, n = _MESSAGE_HEADER.unpack(_recv_exactly(sock, _MESSAGE_HEADER.size))
+    if max_length is not None and n > 1: raise ConnectionError('message too large')
+    parts = []
+    for _ in range(n):
+        (length,) = _PART_HEADER.unpack(_recv_exactly(sock, _PART_HEADER.size))
+        if max_length is not None and length > max_length: raise ConnectionError('message too large')
+        parts.append(_recv_exactly(sock, length))
+    return op, parts
+
+def _recv_exactly(sock: socket.socket, length: int) -> bytearray:
+    buffer = bytearray(length)
+    view = memoryview(buffer)
+    received = 0
+    while received < length:
+        n = sock.recv_into(view[received:], min(length - received, _CHUNK_SIZE))
+        if n == 0: raise ConnectionError('connection closed')
+        received += n
+    return buffer
+
+_TOKEN_VARIABLE = 'MEMOIZER_CACHE_TOKEN'
+
+def main():
+    import argparse
+    from memoizer.caches import FileCache
+    parser = argparse.ArgumentParser(
+        description='serves a FileCache to RemoteCache clients',
+        epilog='SECURITY: clients send pickles, which the server unpickles, and unpickling can run arbitrary code. '
+            f'Serving on a host and port requires a secret token in the {_TOKEN_VARIABLE} environment variable, '
+            'which clients pass as RemoteCache(token=...). Traffic is not encrypted: use trusted networks only.')
+    parser.add_argument('path', help='FileCache folder, ending with a path separator')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--unix', default=None, help='unix socket path, instead of host and port, protected by file permissions')
+    parser.add_argument('--dedup', action='store_true')
+    args = parser.parse_args()
+    address = args.unix if args.unix is not None and not is_windows else (args.host, args.port)
+    token = os.environ.get(_TOKEN_VARIABLE)
+    if type(address) is not str and not token:
+        parser.error(f'serving on a host and port needs a token in {_TOKEN_VARIABLE}, see the security note in --help')
+    with serve(FileCache(args.path, dedup=args.dedup), address, token.encode('utf-8') if token else None) as server:
+        server.serve_forever()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,125 @@
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from datetime import datetime
+from typing import Dict, List, Set
+import heapq
+import os
+from memoizer.caches import AbstractCache, InMemoryCache, NoOpCache
+from memoizer.context import MemoizerContext, current_context
+from memoizer.core import NodeId, CallId
+from memoizer.memoize import _bucketed_node_id
+
+ReplayReport = namedtuple('ReplayReport', ['evaluated', 'unpredicted', 'unused'])
+
+class ReplayPlan:
+    """
+    The DAG recorded under `prior_asof` for a root call, re-targeted to `asof`.
+    Nodes are keyed by the start of their validity range (see `memoize(valid_for=...)`), and a
+    child is evaluated at the asof of its parent's node. So a child recorded under the range of
+    its parent's prior asof moves to the range of its parent's new asof, while children pinned to
+    another asof (via a nested MemoizerContext) keep theirs. `cost` is the recorded self time of a node
+    and `rank` the heaviest recorded path from the node up to the root, so scheduling by
+    descending rank starts the critical path first.
+    """
+    def __init__(self, cache: AbstractCache, root: CallId, prior_asof: datetime, asof: datetime):
+        assert type(root) is CallId and type(prior_asof) is datetime and type(asof) is datetime
+        self.root = _bucketed_node_id(NodeId.from_call_id_and_asof(root, asof))
+        self.children: Dict[NodeId, Set[NodeId]] = {}
+        self.cost: Dict[NodeId, float] = {}
+        stack = [(_bucketed_node_id(NodeId.from_call_id_and_asof(root, prior_asof)), self.root)]
+        while len(stack) > 0:
+            prior_node_id, node_id = stack.pop()
+            if node_id in self.children: continue
+            if cache.contains(prior_node_id):
+                metadata = cache.read_metadata(prior_node_id)
+                _, prior_node_asof = prior_node_id.to_call_id_and_asof()
+                _, node_asof = node_id.to_call_id_and_asof()
+                shifted = [(child, _shift(child, prior_node_asof, node_asof)) for child in metadata.children]
+                self.children[node_id] = set(child for _, child in shifted)
+                self.cost[node_id] = metadata.cpu_time_sec
+                stack.extend(shifted)
+            else:
+                self.children[node_id] = set()
+                self.cost[node_id] = 0.
+        self.parents: Dict[NodeId, Set[NodeId]] = {node_id: set() for node_id in self.children}
+        for node_id, children in self.children.items():
+            for child in children:
+                self.parents[child].add(node_id)
+        self.rank: Dict[NodeId, float] = {}
+        for node_id in reversed(self.schedule()):
+            self.rank[node_id] = self.cost[node_id] + max((self.rank[parent] for parent in self.parents[node_id]), default=0.)
+
+    def schedule(self) -> List[NodeId]:
+        "topological order, leaves first"
+        pending = {node_id: len(children) for node_id, children in self.children.items()}
+        ready = sorted((node_id for node_id, n in pending.items() if n == 0), key=lambda node_id: node_id.id)
+        order = []
+        while len(ready) > 0:
+            node_id = ready.pop()
+            order.append(node_id)
+            for parent in self.parents[node_id]:
+                pending[parent] -= 1
+                if pending[parent] == 0:
+                    ready.append(parent)
+        assert len(order) == len(self.children), 'recorded graph has a cycle'
+        return order
+
+def replay(root: CallId, prior_asof: datetime, max_workers: int = None) -> ReplayReport:
+    """
+    Pre-evaluates the DAG of `root` for the current asof, leaves first on a process pool,
+    using the graph recorded under `prior_asof` as the prediction. A node is submitted once
+    all its predicted children are done, so it normally finds them in the cache. Children that
+    were not predicted are evaluated by ordinary recursion inside the worker.
+    The current cache must be visible from other processes, e.g. a FileCache, as the workers
+    write their results to it.
+    """
+    cache = current_context().cache
+    assert not isinstance(cache, (InMemoryCache, NoOpCache)), f'replay needs a cache shared between processes, not a {type(cache).__name__}'
+    asof = current_context().asof
+    plan = ReplayPlan(cache, root, prior_asof, asof)
+    pending = {node_id: len(children) for node_id, children in plan.children.items()}
+    ready = [(-plan.rank[node_id], node_id.id) for node_id, n in pending.items() if n == 0]
+    heapq.heapify(ready)
+    evaluated, unpredicted, used = [], set(), set()
+    max_workers = max_workers or os.cpu_count() or 1
+    with ProcessPoolExecutor(max_workers, initializer=_init_worker, initargs=(cache,)) as executor:
+        running = {}
+        while len(ready) > 0 or len(running) > 0:
+            while len(ready) > 0 and len(running) < max_workers:
+                _, _id = heapq.heappop(ready)
+                running[executor.submit(_replay_node, _id)] = NodeId(_id)
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                node_id = running.pop(future)
+                children = set(NodeId(_id) for _id in future.result())
+                evaluated.append(node_id)
+                used |= children
+                unpredicted |= children - plan.children[node_id]
+                for parent in plan.parents[node_id]:
+                    pending[parent] -= 1
+                    if pending[parent] == 0:
+                        heapq.heappush(ready, (-plan.rank[parent], parent.id))
+    unused = set(plan.children) - used - {plan.root}
+    return ReplayReport(evaluated, sorted(unpredicted, key=lambda node_id: node_id.id), sorted(unused, key=lambda node_id: node_id.id))
+
+def _shift(node_id: NodeId, prior_asof: datetime, asof: datetime) -> NodeId:
+    "moves a child evaluated at `prior_asof` to `asof`, keeps one pinned to another asof"
+    call_id, _ = node_id.to_call_id_and_asof()
+    if node_id != _bucketed_node_id(NodeId.from_call_id_and_asof(call_id, prior_asof)):
+        return node_id
+    return _bucketed_node_id(NodeId.from_call_id_and_asof(call_id, asof))
+
+_worker_cache = None
+
+def _init_worker(cache: AbstractCache):
+    global _worker_cache
+    _worker_cache = cache
+
+def _replay_node(_id: str) -> List[str]:
+    node_id = _bucketed_node_id(NodeId(_id))
+    call_id, asof = node_id.to_call_id_and_asof()
+    if not _worker_cache.contains(node_id):
+        with MemoizerContext(cache=_worker_cache, asof=asof):
+            f, args, kwargs = call_id.to_call()
+            f(*args, **kwargs)
+    return [child.id for child in _worker_cache.read_metadata(node_id).children]
@@ -0,0 +1,38 @@
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+
+_RUN = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks', 'run.py')
+
+@unittest.skipIf(not os.path.exists(_RUN), 'benchmarks are not part of the installed package')
+class Tests(unittest.TestCase):
+    def test_benchmarks_run(self):
+        with tempfile.TemporaryDirectory() as path:
+            output = os.path.join(path, 'results.json')
+            subprocess.run([sys.executable, _RUN, '--scale', '0.01', '--repeat', '1', '--output', output], check=True, capture_output=True)
+            with open(output) as f:
+                results = json.load(f)
+            assert 'eval_cache_hit' in results['results'] and results['results']['eval_cache_hit']['sec_per_op'] > 0
+
+            # against itself nothing regresses, against a baseline 1000 times faster everything does
+            proc = subprocess.run([sys.executable, _RUN, '--filter', 'call_to_id', '--scale', '0.01', '--repeat', '1', '--baseline', output, '--threshold', '1000'], capture_output=True)
+            assert proc.returncode == 0, proc.stdout
+            for result in results['results'].values():
+                result['sec_per_op'] /= 1000 ** 2
+            with open(output, 'w') as f:
+                json.dump(results, f)
+            proc = subprocess.run([sys.executable, _RUN, '--filter', 'call_to_id', '--scale', '0.01', '--repeat', '1', '--baseline', output, '--threshold', '1000'], capture_output=True)
+            assert proc.returncode == 1 and b'REGRESSION' in proc.stdout, proc.stdout
+
+            # a benchmark missing from the baseline fails the comparison too
+            results['results'] = {}
+            with open(output, 'w') as f:
+                json.dump(results, f)
+            proc = subprocess.run([sys.executable, _RUN, '--filter', 'call_to_id', '--scale', '0.01', '--repeat', '1', '--baseline', output], capture_output=True)
+            assert proc.returncode == 1 and b'NO BASELINE' in proc.stdout, proc.stdout
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
@@ -0,0 +1,240 @@
+import unittest
+import tempfile
+import os
+import mmap
+import pickle
+import multiprocessing
+from datetime import datetime
+from memoizer.caches import FileCache, SharedMemoryCache, SqliteCache
+from memoizer.core import NodeId, CallId, Metadata
+
+def _test_fun(x):
+    return x
+
+def _metadata(node_id: NodeId) -> Metadata:
+    call_id, asof = node_id.to_call_id_and_asof()
+    now = datetime.now()
+    return Metadata(node_id, call_id, asof, __name__, _test_fun.__name__, (), {}, [], now, now, 0.0, '', 'list')
+
+def _node_id(x, asof: datetime) -> NodeId:
+    return NodeId.from_call(asof, _test_fun, x)
+
+def _write_in_other_process(cache: SqliteCache, i: int):
+    node_ids = [_node_id((i, j), datetime(2024, 4, 1)) for j in range(50)]
+    cache.write_many([(node_id, j, _metadata(node_id)) for j, node_id in enumerate(node_ids)])
+
+def _read_in_other_process(cache: SharedMemoryCache, node_id: NodeId, queue):
+    queue.put((cache.contains(node_id), bytes(cache.read_result(node_id)), cache.read_metadata(node_id).node_id.id))
+
+class Tests(unittest.TestCase):
+    def test_file_cache_dedup(self):
+        with tempfile.TemporaryDirectory() as path:
+            cache = FileCache(path + '/', dedup=True)
+            result = list(range(1000))
+            node_ids = [_node_id(1, datetime(2024, 4, day)) for day in (1, 2, 3)]
+            for node_id in node_ids:
+                cache.write(node_id, result, _metadata(node_id))
+            other = _node_id(2, datetime(2024, 4, 1))
+            cache.write(other, [2], _metadata(other))
+
+            stats = cache.stats()
+            assert stats['blobs'] == 2 and stats['references'] == 4, stats
+            assert stats['dedup_ratio'] > 2.5, stats
+            for node_id in node_ids:
+                assert cache.read_result(node_id) == result
+
+            cache.remove(node_ids[0])
+            assert not cache.contains(node_ids[0])
+            assert cache.read_result(node_ids[1]) == result
+            assert cache.stats()['blobs'] == 2
+
+            cache.remove(node_ids[1])
+            cache.remove(node_ids[2])
+            cache.remove(other)
+            assert cache.stats()['blobs'] == 0
+            assert cache.gc() == 0
+
+    def test_file_cache_dedup_overwrite_and_gc(self):
+        with tempfile.TemporaryDirectory() as path:
+            cache = FileCache(path + '/', dedup=True)
+            node_id = _node_id(1, datetime(2024, 4, 1))
+            cache.write(node_id, [1], _metadata(node_id))
+            cache.write(node_id, [2], _metadata(node_id))
+            assert cache.read_result(node_id) == [2]
+            assert cache.stats()['blobs'] == 2
+            assert cache.gc() == 1
+            assert cache.stats()['blobs'] == 1
+
+    def test_file_cache_dedup_shared_with_plain(self):
+        with tempfile.TemporaryDirectory() as path:
+            dedup, plain = FileCache(path + '/', dedup=True), FileCache(path + '/')
+            node_ids = [_node_id(1, datetime(2024, 4, day)) for day in (1, 2)]
+            for node_id in node_ids:
+                dedup.write(node_id, 'same', _metadata(node_id))
+            plain.write(node_ids[0], 'changed', _metadata(node_ids[0]))
+            reader = FileCache(path + '/')
+            assert reader.read_result(node_ids[0]) == 'changed'
+            assert reader.read_result(node_ids[1]) == 'same'
+            assert dedup.stats()['references'] == 1
+
+    def test_file_cache_dedup_concurrent_writers(self):
+        from concurrent.futures import ThreadPoolExecutor
+        with tempfile.TemporaryDirectory() as path:
+            cache = FileCache(path + '/', dedup=True)
+            node_id = _node_id(1, datetime(2024, 4, 1))
+            write = lambda i: cache.write(node_id, [i % 2], _metadata(node_id))
+            with ThreadPoolExecutor(8) as executor:
+                list(executor.map(write, range(200)))
+            assert cache.read_result(node_id) in ([0], [1])
+            assert not any(fname.endswith('.tmp') for fname in os.listdir(os.path.join(path, node_id.to_folder())))
+
+    def test_shared_memory_cache(self):
+        cache = SharedMemoryCache(f"memoizer_test_{os.getpid()}", capacity_bytes=10 ** 6, n_slots=64)
+        try:
+            node_id = _node_id(1, datetime(2024, 4, 1))
+            assert not cache.contains(node_id)
+            cache.write(node_id, {'a': [1, 2]}, _metadata(node_id))
+            assert cache.contains(node_id)
+            assert cache.read_result(node_id) == {'a': [1, 2]}
+            assert cache.read_metadata(node_id).node_id == node_id
+            assert SharedMemoryCache(cache.name).read_result(node_id) == {'a': [1, 2]}
+            cache.remove(node_id)
+            assert not cache.contains(node_id)
+            self.assertRaises(KeyError, cache.read_result, node_id)
+
+            call_id, _ = node_id.to_call_id_and_asof()
+            assert cache.get_latest_node_id_by_call_id(call_id) is None
+            node_ids = [_node_id(1, datetime(2024, 4, day)) for day in (3, 1, 2)]
+            for other in node_ids + [_node_id(2, datetime(2024, 4, 4))]:
+                cache.write(other, 1, _metadata(other))
+            assert cache.list_node_ids_by_call_id(call_id) == sorted(node_ids, key=lambda other: other.id)
+            assert cache.get_latest_node_id_by_call_id(call_id) == node_ids[0]
+            for other in cache.list_node_ids():
+                cache.remove(other)
+
+            # large buffers are read zero-copy and read-only from shared memory, also in other processes
+            content = os.urandom(100000)
+            cache.write(node_id, pickle.PickleBuffer(bytearray(content)), _metadata(node_id))
+            view = cache.read_result(node_id)
+            assert type(view) is memoryview and view.readonly and type(view.obj) is mmap.mmap
+            assert bytes(view) == content
+            ctx = multiprocessing.get_context('spawn')
+            queue = ctx.Queue()
+            process = ctx.Process(target=_read_in_other_process, args=(cache, node_id, queue))
+            process.start()
+            assert queue.get(timeout=60) == (True, content, node_id.id)
+            process.join()
+            # the view survives eviction of its entry
+            cache.remove(node_id)
+            assert bytes(view) == content
+            del view
+
+            # least recently read entries are evicted to stay within capacity
+            node_ids = [_node_id(i, datetime(2024, 4, 2)) for i in range(40)]
+            for i, node_id in enumerate(node_ids):
+                cache.write(node_id, os.urandom(50000), _metadata(node_id))
+                cache.read_result(node_ids[0])
+            stats = cache.stats()
+            assert stats['used_bytes'] <= 10 ** 6 and stats['entries'] < 40, stats
+            assert cache.contains(node_ids[0]) and cache.contains(node_ids[-1]) and not cache.contains(node_ids[1])
+            assert sorted(n.id for n in cache.list_node_ids()) == sorted(n.id for n in node_ids if cache.contains(n))
+        finally:
+            cache.unlink()
+
+    def test_shared_memory_cache_untracked(self):
+        # forked processes share a resource tracker, per attach registrations would interleave between them
+        from multiprocessing import resource_tracker
+        calls = []
+        register, unregister = resource_tracker.register, resource_tracker.unregister
+        resource_tracker.register = lambda *args: calls.append(('register',) + args)
+        resource_tracker.unregister = lambda *args: calls.append(('unregister',) + args)
+        try:
+            cache = SharedMemoryCache(f"memoizer_test_untracked_{os.getpid()}", capacity_bytes=10 ** 6, n_slots=64)
+            node_id = _node_id(1, datetime(2024, 4, 1))
+            cache.write(node_id, [1], _metadata(node_id))
+            assert SharedMemoryCache(cache.name).read_result(node_id) == [1]
+            cache.remove(node_id)
+            cache.unlink()
+        finally:
+            resource_tracker.register, resource_tracker.unregister = register, unregister
+        assert calls == [], calls
+
+    def test_sqlite_cache(self):
+        with tempfile.TemporaryDirectory() as path:
+            cache = SqliteCache(os.path.join(path, 'cache.db'), spill_threshold_bytes=10000)
+            call_id = CallId.from_call(_test_fun, 1)
+            node_ids = [_node_id(1, asof) for asof in (datetime(2024, 4, 2), datetime(2024, 4, 1, 12, 30), datetime(2024, 4, 1))]
+            assert cache.get_latest_node_id_by_call_id(call_id) is None
+            for i, node_id in enumerate(node_ids):
+                assert not cache.contains(node_id)
+                cache.write(node_id, [i], _metadata(node_id))
+                assert cache.contains(node_id)
+                assert cache.read_result(node_id) == [i]
+                assert cache.read_metadata(node_id).node_id == node_id
+            assert cache.list_node_ids_by_call_id(call_id) == node_ids[::-1]
+            assert cache.get_latest_node_id_by_call_id(call_id) == node_ids[0]
+            assert sorted(n.id for n in cache.list_node_ids()) == sorted(n.id for n in node_ids)
+            cache.remove(node_ids[0])
+            assert cache.get_latest_node_id_by_call_id(call_id) == node_ids[1]
+            self.assertRaises(KeyError, cache.read_result, node_ids[0])
+
+            # large results are spilled to files shared by equal results, removed with the last node using them
+            large = list(range(10000))
+            cache.write(node_ids[1], large, _metadata(node_ids[1]))
+            cache.write(node_ids[2], large, _metadata(node_ids[2]))
+            blobs_folder = os.path.join(path, 'cache.db.blobs')
+            assert len(os.listdir(blobs_folder)) == 1
+            assert cache.read_result(node_ids[2]) == large
+            cache.remove(node_ids[1])
+            assert len(os.listdir(blobs_folder)) == 1
+            cache.write(node_ids[2], 'small', _metadata(node_ids[2]))
+            assert len(os.listdir(blobs_folder)) == 0
+
+            # a reader whose spilled result is removed after it read the row misses or reads the new row
+            read = cache._read
+            def read_then_overwrite(node_id, columns):
+                cache._read = read
+                row = read(node_id, columns)
+                cache.write(node_id, large[::-1], _metadata(node_id))
+                return row
+            cache.write(node_ids[1], large, _metadata(node_ids[1]))
+            cache._read = read_then_overwrite
+            assert cache.read_result(node_ids[1]) == large[::-1]
+            os.remove(os.path.join(blobs_folder, os.listdir(blobs_folder)[0]))
+            self.assertRaises(KeyError, cache.read_result, node_ids[1])
+            cache.remove(node_ids[1])
+
+            # a rolled back overwrite or removal keeps the spilled result of the node
+            cache.write(node_ids[2], large, _metadata(node_ids[2]))
+            for change in (lambda: cache.write(node_ids[2], 'small', _metadata(node_ids[2])), lambda: cache.remove(node_ids[2])):
+                try:
+                    with cache.transaction():
+                        change()
+                        raise ValueError()
+                except ValueError:
+                    pass
+                assert cache.read_result(node_ids[2]) == large
+            cache.write(node_ids[2], 'small', _metadata(node_ids[2]))
+            assert len(os.listdir(blobs_folder)) == 0
+
+            # a failed transaction writes nothing
+            try:
+                with cache.transaction():
+                    cache.write(node_ids[0], large, _metadata(node_ids[0]))
+                    raise ValueError()
+            except ValueError:
+                pass
+            assert not cache.contains(node_ids[0])
+            assert cache.gc() == 1
+
+            # concurrent writers in other processes
+            ctx = multiprocessing.get_context('spawn')
+            processes = [ctx.Process(target=_write_in_other_process, args=(cache, i)) for i in range(3)]
+            for process in processes: process.start()
+            for process in processes: process.join()
+            assert all(process.exitcode == 0 for process in processes)
+            assert cache.read_result(_node_id((2, 49), datetime(2024, 4, 1))) == 49
+            assert len(cache.list_node_ids()) == 1 + 3 * 50
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
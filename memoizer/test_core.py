@@ -1,7 +1,8 @@
 import unittest
 from datetime import datetime
 from urllib.parse import quote
-from memoizer.core import CallId, _obj_to_str, _parse_obj, _args_to_str, datetime_from_str, datetime_to_str
+from memoizer import core
+from memoizer.core import CallId, NodeId, Metadata, _obj_to_str, _parse_obj, _args_to_str, datetime_from_str, datetime_to_str
 # from .memoizer import memoize
 
 # @memoize
@@ -86,5 +87,51 @@ class Tests(unittest.TestCase):
             assert dt == datetime_from_str(s), [dt, datetime_from_str(s)]
             assert datetime_to_str(dt) == s, [datetime_to_str(dt), s]
 
+    def test_node_id(self):
+        import pickle
+        from memoizer.core import _call_id_to_fname
+        asof = datetime(2024, 4, 26, 12, 23, 45)
+        call_id = CallId.from_call(_test_fun, 'a/b' * 30)
+        built = NodeId.from_call_id_and_asof(call_id, asof)
+        parsed = NodeId(built.id)
+        assert built == parsed and hash(built) == hash(parsed)
+        assert built.id == f"{call_id.id}@2024-04-26 12:23:45"
+        for node_id in (built, parsed, pickle.loads(pickle.dumps(built))):
+            assert node_id.to_call_id_and_asof() == (call_id, asof)
+            assert node_id.to_fname() == _call_id_to_fname(call_id.id)
+            assert node_id.to_folder() == '2024-04-26 12-23-45'
+            assert NodeId.from_query_string(node_id.to_query_string()) == built
+        assert not hasattr(built, '__dict__') and not hasattr(call_id, '__dict__')
+
+    def test_metadata(self):
+        import pickle
+        asof = datetime(2024, 4, 26)
+        call_id = CallId.from_call(_test_fun, 'hello', (1, None), (1,), a={2, 3})
+        kwargs = dict(
+            node_id=NodeId.from_call_id_and_asof(call_id, asof), call_id=call_id, asof=asof,
+            module=__name__, function='_test_fun', args=('hello', (1, None), (1,)), kwargs={'a': {2, 3}},
+            children=[NodeId.from_call(asof, _test_fun, 1), NodeId.from_call(datetime.min, _test_fun, 2)],
+            start_time=datetime(2024, 4, 26, 12, 23, 45, 123), end_time=datetime(2024, 4, 26, 12, 23, 46),
+            cpu_time_sec=1.5, source='def _test_fun():\n    pass\n', return_type='NoneType',
+        )
+        metadata = Metadata(**kwargs)
+        assert not hasattr(metadata, '__dict__')
+        assert Metadata(**kwargs).source is metadata.source
+
+        # legacy pickles hold the plain object's __dict__
+        legacy_cls = type('Metadata', (), {'__module__': core.__name__})
+        legacy = legacy_cls()
+        legacy.__dict__.update(kwargs)
+        core.Metadata = legacy_cls
+        try:
+            legacy_buffer = pickle.dumps(legacy)
+        finally:
+            core.Metadata = Metadata
+
+        for decoded in (Metadata.decode(metadata.encode()), pickle.loads(pickle.dumps(metadata)), pickle.loads(legacy_buffer)):
+            assert type(decoded) is Metadata
+            for k, v in kwargs.items():
+                assert getattr(decoded, k) == v, [k, getattr(decoded, k), v]
+
 if __name__ == '__main__':
     unittest.main(verbosity=2)
\ No newline at end of file
@@ -0,0 +1,30 @@
+import subprocess
+import sys
+import unittest
+
+_IMPORT_TIME_BUDGET_US = 300000
+_LAZY_MODULES = ['pandas', 'numpy', 'memoizer.html_templates', 'memoizer.web']
+
+def _import_times(statement):
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', statement], capture_output=True, text=True, check=True)
+    times = {}
+    for line in proc.stderr.splitlines():
+        if not line.startswith('import time:') or 'imported package' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        if cumulative.strip().isdigit():
+            times[name.strip()] = int(cumulative)
+    return times
+
+class Tests(unittest.TestCase):
+    def test_import_is_stdlib_only(self):
+        times = _import_times('import memoizer')
+        for module in _LAZY_MODULES:
+            assert module not in times, [module, sorted(times)]
+
+    def test_import_time_budget(self):
+        times = _import_times('import memoizer')
+        assert times['memoizer'] <= _IMPORT_TIME_BUDGET_US, [times['memoizer'], _IMPORT_TIME_BUDGET_US]
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
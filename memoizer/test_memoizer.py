@@ -1,13 +1,38 @@
-from memoizer import memoize, MemoizerContext, InMemoryCache
+from memoizer import memoize, blow_cache, wait_for_fresh, current_asof, MemoizerContext, InMemoryCache
 from memoizer.core import NodeId, CallId
 import unittest
-from datetime import datetime
+from datetime import datetime, timedelta
 import os
 
 @memoize
 def fib(n):
     return fib(n-1) + fib(n-2) if n > 1 else n
 
+_version = [1]
+
+@memoize
+def versioned(n):
+    return (_version[0], n)
+
+@memoize
+def versioned_parent(n):
+    return versioned(n)[0] + 100
+
+_evaluated = []
+
+@memoize(valid_for='month')
+def monthly(n):
+    _evaluated.append(current_asof())
+    return daily(n)
+
+@memoize(valid_for='1D')
+def daily(n):
+    return (current_asof(), n)
+
+@memoize(valid_for=lambda asof: datetime(asof.year, 1 if asof.month < 7 else 7, 1))
+def half_yearly():
+    return current_asof()
+
 class Tests(unittest.TestCase):
     def test_memoizer(self):
         asof = datetime(2024, 4, 27, 12, 0, 0)
@@ -16,5 +41,149 @@ class Tests(unittest.TestCase):
             with MemoizerContext(asof=asof):
                 fib(10)
 
+    def test_valid_for(self):
+        from memoizer.memoize import _asof_bucket
+        from memoizer.web import handle_eval
+        cache = InMemoryCache()
+        for asof in (datetime(2024, 4, 3, 9, 30), datetime(2024, 4, 29)):
+            with MemoizerContext(cache=cache, asof=asof):
+                assert monthly(1) == (datetime(2024, 4, 1), 1)
+                assert daily(1) == (datetime(asof.year, asof.month, asof.day), 1)
+                assert half_yearly() == datetime(2024, 1, 1)
+        assert _evaluated == [datetime(2024, 4, 1)]
+        assert NodeId.from_call(datetime(2024, 4, 1), monthly, 1) in cache.list_node_ids()
+        assert 'memoizer.test_memoizer.monthly(1)@2024-04-01' in handle_eval(cache, NodeId.from_call(datetime(2024, 4, 15), monthly, 1))
+
+        with MemoizerContext(cache=cache, asof=datetime(2024, 4, 15)):
+            blow_cache(monthly, 1)
+            monthly(1)
+        with MemoizerContext(cache=cache, asof=datetime(2024, 5, 1)):
+            monthly(1)
+        assert _evaluated == [datetime(2024, 4, 1)] * 2 + [datetime(2024, 5, 1)]
+
+        test_cases = [
+            ('year', datetime(2024, 4, 3, 9, 30), datetime(2024, 1, 1)),
+            ('week', datetime(2024, 4, 3, 9, 30), datetime(2024, 4, 1)),
+            ('day', datetime(2024, 4, 3, 9, 30), datetime(2024, 4, 3)),
+            ('2D', datetime(2024, 4, 3, 9, 30), datetime(2024, 4, 3)),
+            ('2D', datetime(2024, 4, 4, 9, 30), datetime(2024, 4, 3)),
+            ('H', datetime(2024, 4, 3, 9, 30, 15, 5), datetime(2024, 4, 3, 9)),
+            ('4H', datetime(2024, 4, 3, 9, 30), datetime(2024, 4, 3, 8)),
+            ('15min', datetime(2024, 4, 3, 9, 44, 59), datetime(2024, 4, 3, 9, 30)),
+            ('30s', datetime(2024, 4, 3, 9, 44, 59, 999), datetime(2024, 4, 3, 9, 44, 30)),
+            ('1D', datetime.min, datetime.min),
+        ]
+        for valid_for, asof, expected in test_cases:
+            assert _asof_bucket(valid_for)(asof) == expected, [valid_for, asof, _asof_bucket(valid_for)(asof)]
+        for valid_for in ('0D', '1M', 'monthly', ''):
+            self.assertRaises(Exception, _asof_bucket, valid_for)
+
+    def test_entry_evicted_after_contains(self):
+        from memoizer import SharedMemoryCache
+        cache = SharedMemoryCache(f"memoizer_test_evicted_{os.getpid()}", capacity_bytes=10 ** 6, n_slots=64)
+        try:
+            context = MemoizerContext(cache=cache, asof=datetime(2024, 4, 1))
+            with context:
+                fib(5)
+            # another process sharing the cache evicts every entry right after it was found
+            other = SharedMemoryCache(cache.name)
+            contains = cache.contains
+            def contains_then_evicted(node_id):
+                found = contains(node_id)
+                if found: other.remove(node_id)
+                return found
+            cache.contains = contains_then_evicted
+            with context:
+                assert fib(5) == 5
+            assert contains(NodeId.from_call(datetime(2024, 4, 1), fib, 5))
+        finally:
+            cache.unlink()
+
+    def test_stale_while_revalidate_file_cache(self):
+        import tempfile
+        from memoizer import FileCache
+        with tempfile.TemporaryDirectory() as path:
+            cache = FileCache(os.path.join(path, 'cache') + '/') # its folder does not exist before the first write
+            try:
+                with MemoizerContext(cache=cache, asof=datetime(2024, 4, 2), max_staleness=timedelta(days=3)):
+                    assert versioned(7) == (1, 7)
+                _version[0] = 2
+                with MemoizerContext(cache=cache, asof=datetime(2024, 4, 3), max_staleness=timedelta(days=3)):
+                    assert versioned(7) == (1, 7)
+                    assert wait_for_fresh(versioned, 7) == (2, 7)
+            finally:
+                _version[0] = 1
+
+    def test_web_serves_cached_node_of_removed_function(self):
+        from memoizer.web import handle_eval
+        from memoizer.core import Metadata
+        asof = datetime(2024, 4, 1)
+        call_id = CallId('memoizer_removed_module.removed(1)')
+        node_id = NodeId.from_call_id_and_asof(call_id, asof)
+        cache = InMemoryCache()
+        cache.write(node_id, 4242, Metadata(node_id, call_id, asof, 'memoizer_removed_module', 'removed', (1,), {}, [], asof, asof, 0.0, '', 'int'))
+        assert '4242' in handle_eval(cache, node_id)
+
+    def test_context_per_thread(self):
+        from concurrent.futures import ThreadPoolExecutor
+        from memoizer import current_cache, current_asof
+        cache, other = InMemoryCache(), InMemoryCache()
+        def work_in_own_context(n):
+            with MemoizerContext(cache=other):
+                return fib(n), current_asof()
+        with MemoizerContext(cache=cache, asof=datetime(2024, 4, 1)), ThreadPoolExecutor(2) as executor:
+            # worker threads use the main thread's context, until they enter their own
+            assert executor.submit(current_cache).result() is cache
+            assert list(executor.map(fib, range(5))) == [0, 1, 1, 2, 3]
+            assert executor.submit(work_in_own_context, 6).result() == (8, datetime(2024, 4, 1))
+            assert current_cache() is cache
+        assert cache.contains(NodeId.from_call(datetime(2024, 4, 1), fib, 4))
+        assert other.contains(NodeId.from_call(datetime(2024, 4, 1), fib, 6))
+        assert not cache.contains(NodeId.from_call(datetime(2024, 4, 1), fib, 6))
+
+    def test_stale_while_revalidate(self):
+        from memoizer.web import handle_eval
+        cache = InMemoryCache()
+        day = lambda d: datetime(2024, 4, d)
+        try:
+            with MemoizerContext(cache=cache, asof=day(1)):
+                assert versioned(1) == (1, 1)
+            _version[0] = 2
+            with MemoizerContext(cache=cache, asof=day(3), max_staleness=timedelta(days=3)):
+                assert versioned(1) == (1, 1)
+                assert wait_for_fresh(versioned, 1) == (2, 1)
+                assert versioned(1) == (2, 1)
+
+            # a node computed from a stale result is stale too, so it is not cached as fresh
+            _version[0] = 3
+            with MemoizerContext(cache=cache, asof=day(4), max_staleness=timedelta(days=3)):
+                assert versioned_parent(1) == 102
+                assert wait_for_fresh(versioned_parent, 1) == 103
+                assert cache.contains(NodeId.from_call(day(4), versioned_parent, 1))
+
+            # too stale, or older asofs only served when the mode is on
+            with MemoizerContext(cache=cache, asof=day(20), max_staleness=timedelta(days=3)):
+                assert versioned(1) == (3, 1)
+            _version[0] = 4
+            with MemoizerContext(cache=cache, asof=day(21)):
+                assert versioned(1) == (4, 1)
+
+            # the web marks stale results
+            _version[0] = 5
+            html = handle_eval(cache, NodeId.from_call(day(22), versioned, 1), max_staleness=timedelta(days=1))
+            assert 'stale result as of 2024-04-21' in html and '(4, 1)' in html
+            with MemoizerContext(cache=cache, asof=day(22)):
+                assert wait_for_fresh(versioned, 1) == (5, 1)
+
+            # a node with stale children but no earlier result of its own is served fresh
+            with MemoizerContext(cache=cache, asof=day(25)):
+                versioned(2)
+            _version[0] = 6
+            html = handle_eval(cache, NodeId.from_call(day(26), versioned_parent, 2), max_staleness=timedelta(days=3))
+            assert '106' in html and 'stale result' not in html
+            assert cache.contains(NodeId.from_call(day(26), versioned_parent, 2))
+        finally:
+            _version[0] = 1
+
 if __name__ == "__main__":
     unittest.main(verbosity=2)
\ No newline at end of file
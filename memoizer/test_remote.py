@@ -0,0 +1,86 @@
+import unittest
+import tempfile
+import os
+import pickle
+import threading
+from datetime import datetime
+from memoizer import memoize, MemoizerContext, InMemoryCache
+from memoizer.core import NodeId, CallId
+from memoizer.remote import RemoteCache, serve
+from memoizer.test_caches import _metadata, _node_id
+
+@memoize
+def square(n):
+    return n * n
+
+class Tests(unittest.TestCase):
+    def _test_remote_cache(self, address, token=None):
+        import socketserver
+        with serve(InMemoryCache(), address, token) as server:
+            assert server.daemon_threads and not socketserver.ThreadingTCPServer.daemon_threads
+            thread = threading.Thread(target=server.serve_forever, daemon=True)
+            thread.start()
+            cache = RemoteCache(server.server_address, max_connections=2, token=token)
+            try:
+                node_id = _node_id(1, datetime(2024, 4, 1))
+                assert not cache.contains(node_id)
+                self.assertRaises(KeyError, cache.read_result, node_id)
+                cache.write(node_id, {'a': [1, 2]}, _metadata(node_id))
+                assert cache.contains(node_id)
+                assert cache.read_result(node_id) == {'a': [1, 2]}
+                assert cache.read_metadata(node_id).node_id == node_id
+                assert cache.list_node_ids() == [node_id]
+                assert cache.list_node_ids_by_call_id(node_id.to_call_id_and_asof()[0]) == [node_id]
+                assert cache.get_latest_node_id_by_call_id(CallId.from_call(square, 3)) is None
+
+                # results larger than a chunk, with out-of-band buffers, survive the round trip
+                content = os.urandom(3 * 2 ** 20 + 1)
+                cache.write(node_id, [pickle.PickleBuffer(bytearray(content)), content], _metadata(node_id))
+                buffer, copy = cache.read_result(node_id)
+                assert bytes(buffer) == content and copy == content
+
+                # pipelined writes and batched reads
+                node_ids = [_node_id(i, datetime(2024, 4, 2)) for i in range(100)]
+                cache.write_many([(n, i, _metadata(n)) for i, n in enumerate(node_ids)])
+                assert cache.contains_many(node_ids + [_node_id(-1, datetime(2024, 4, 2))]) == [True] * 100 + [False]
+                assert cache.read_results(node_ids) == list(range(100))
+                self.assertRaises(KeyError, cache.read_results, [_node_id(-1, datetime(2024, 4, 2))])
+                cache.remove(node_ids[0])
+                assert not cache.contains(node_ids[0])
+
+                # a batch whose responses do not fit in the socket buffers does not deadlock
+                node_ids = [_node_id(i, datetime(2024, 4, 4)) for i in range(5000)]
+                cache.write_many((n, i, _metadata(n)) for i, n in enumerate(node_ids))
+                assert cache.contains_many(node_ids) == [True] * len(node_ids)
+
+                # the client pickles as its address and works as the cache of a memoizer context
+                with MemoizerContext(cache=pickle.loads(pickle.dumps(cache)), asof=datetime(2024, 4, 3)):
+                    assert square(3) == 9
+                assert cache.read_result(NodeId.from_call(datetime(2024, 4, 3), square, 3)) == 9
+            finally:
+                cache.close()
+                server.shutdown()
+
+    def test_remote_cache_tcp(self):
+        self._test_remote_cache(('127.0.0.1', 0), token=b'secret')
+
+    def test_remote_cache_token(self):
+        # servers on a host and port only read requests from clients holding their token
+        self.assertRaises(AssertionError, serve, InMemoryCache(), ('127.0.0.1', 0))
+        node_id = _node_id(1, datetime(2024, 4, 1))
+        with serve(InMemoryCache(), ('127.0.0.1', 0), b'secret') as server:
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+            try:
+                self.assertRaises(PermissionError, RemoteCache(server.server_address).contains, node_id)
+                self.assertRaises(ConnectionError, RemoteCache(server.server_address, token=b'wrong').contains, node_id)
+                assert not RemoteCache(server.server_address, token=b'secret').contains(node_id)
+            finally:
+                server.shutdown()
+
+    @unittest.skipIf(os.name == 'nt', 'unix sockets')
+    def test_remote_cache_unix(self):
+        with tempfile.TemporaryDirectory() as path:
+            self._test_remote_cache(os.path.join(path, 'cache.sock'))
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
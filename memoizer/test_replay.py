@@ -0,0 +1,88 @@
+import unittest
+import tempfile
+from datetime import datetime
+from memoizer import memoize, MemoizerContext, FileCache, InMemoryCache, current_asof
+from memoizer.core import NodeId, CallId
+from memoizer.replay import ReplayPlan, replay
+
+@memoize
+def leaf(n):
+    return n
+
+@memoize
+def pinned():
+    return 42
+
+@memoize
+def mid(n):
+    with MemoizerContext(asof=datetime(2000, 1, 1)):
+        p = pinned()
+    return leaf(n) + leaf(n + 1) + p + (leaf(10) if current_asof() >= datetime(2024, 4, 29) else 0)
+
+@memoize
+def root():
+    return mid(0) + mid(1)
+
+@memoize(valid_for='week')
+def weekly():
+    return current_asof().day
+
+@memoize(valid_for='month')
+def monthly_root():
+    return mid(0) + weekly()
+
+class Tests(unittest.TestCase):
+    def test_plan(self):
+        prior_asof, asof = datetime(2024, 4, 26), datetime(2024, 4, 29)
+        with tempfile.TemporaryDirectory() as path:
+            cache = FileCache(path + '/')
+            with MemoizerContext(cache=cache, asof=prior_asof):
+                root()
+            plan = ReplayPlan(cache, CallId.from_call(root), prior_asof, asof)
+            assert len(plan.children) == 7, plan.children
+            assert NodeId.from_call(datetime(2000, 1, 1), pinned) in plan.children
+            schedule = plan.schedule()
+            assert schedule[-1] == NodeId.from_call(asof, root)
+            for i, node_id in enumerate(schedule):
+                assert plan.children[node_id] <= set(schedule[:i])
+            assert plan.rank[NodeId.from_call(asof, leaf, 0)] >= plan.rank[NodeId.from_call(asof, mid, 0)]
+
+    def test_replay(self):
+        prior_asof, asof = datetime(2024, 4, 26), datetime(2024, 4, 29)
+        with tempfile.TemporaryDirectory() as path:
+            cache = FileCache(path + '/')
+            with MemoizerContext(cache=cache, asof=prior_asof):
+                expected = root()
+            with MemoizerContext(cache=cache, asof=asof):
+                report = replay(CallId.from_call(root), prior_asof, max_workers=2)
+                assert cache.contains(NodeId.from_call(asof, root))
+                assert root() == expected + 2 * 10
+            assert len(report.evaluated) == 7
+            assert report.unpredicted == [NodeId.from_call(asof, leaf, 10)], report.unpredicted
+            assert report.unused == []
+
+    def test_replay_valid_for(self):
+        # nodes move from the ranges of the prior asof to those of the new one: monthly_root from
+        # 2024-04-01 to 2024-05-01, and weekly, evaluated at those, from 2024-04-01 to 2024-04-29
+        prior_asof, asof = datetime(2024, 4, 26), datetime(2024, 5, 27)
+        with tempfile.TemporaryDirectory() as path:
+            cache = FileCache(path + '/')
+            with MemoizerContext(cache=cache, asof=prior_asof):
+                monthly_root()
+            plan = ReplayPlan(cache, CallId.from_call(monthly_root), prior_asof, asof)
+            assert plan.root == NodeId.from_call(datetime(2024, 5, 1), monthly_root)
+            assert plan.children[plan.root] == {NodeId.from_call(datetime(2024, 5, 1), mid, 0), NodeId.from_call(datetime(2024, 4, 29), weekly)}
+            with MemoizerContext(cache=cache, asof=asof):
+                report = replay(CallId.from_call(monthly_root), prior_asof, max_workers=2)
+                assert cache.contains(plan.root)
+                assert monthly_root() == 0 + 1 + 42 + 10 + 29
+            assert len(report.evaluated) == 6
+            assert report.unpredicted == [NodeId.from_call(datetime(2024, 5, 1), leaf, 10)], report.unpredicted
+            assert report.unused == []
+
+    def test_replay_needs_shared_cache(self):
+        with MemoizerContext(cache=InMemoryCache(), asof=datetime(2024, 4, 29)):
+            self.assertRaises(AssertionError, replay, CallId.from_call(root), datetime(2024, 4, 26))
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
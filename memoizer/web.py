@@ -1,11 +1,12 @@
-import pandas as pd
 from .core import NodeId
 from .caches import AbstractCache
-from .context import MemoizerContext
+from .context import MemoizerContext, _ExactContext, current_context
 from .html_templates import render_html
 from .context import current_asof
+from .memoize import _latest_earlier_node_id, _bucketed_node_id
+from datetime import timedelta
 import io
-from typing import Callable
+from typing import Callable, Tuple
 from enum import Enum
 Endpoint = Enum("Endpoint", ["eval", "latest", "download_csv"])
 
@@ -24,15 +25,18 @@ def _node_id_to_url(endpoint: Endpoint, node_id: NodeId) -> str:
         query_string = node_id.to_query_string()
     return f"/{endpoint.name}?{query_string}"
 
-def handle_eval(cache: AbstractCache, node_id: NodeId) -> str:
-    _eval(cache, node_id)
-    metadata = cache.read_metadata(node_id)
-    res = cache.read_result(node_id)
+def handle_eval(cache: AbstractCache, node_id: NodeId, max_staleness: timedelta = None) -> str:
+    served_node_id, stale = _eval(cache, node_id, max_staleness)
+    metadata = cache.read_metadata(served_node_id)
+    if stale:
+        metadata = metadata.as_stale()
+    res = cache.read_result(served_node_id)
     html = render_html(res, metadata, lambda node_id: _node_id_to_url(Endpoint.eval, node_id), lambda node_id: _node_id_to_url(Endpoint.download_csv, node_id))
     return html
 
 def handle_download_csv(cache: AbstractCache, node_id: NodeId) -> str:
-    _eval(cache, node_id)
+    node_id, _ = _eval(cache, node_id)
+    import pandas as pd
     df = cache.read_result(node_id)
     assert type(df) is pd.DataFrame
     bytes_io = io.BytesIO()
@@ -42,9 +46,24 @@ def handle_download_csv(cache: AbstractCache, node_id: NodeId) -> str:
     fname = call_id.to_fname() + '.csv'
     return fname, bytes_io
 
-def _eval(cache: AbstractCache, node_id: NodeId) -> NodeId:
+def _eval(cache: AbstractCache, node_id: NodeId, max_staleness: timedelta = None) -> Tuple[NodeId, bool]:
+    """
+    evaluates the node if needed, returns the node whose result to serve, an earlier one when serving stale,
+    and whether it is stale. A cached node is served without importing its function, which may no longer exist
+    """
+    if cache.contains(node_id):
+        return node_id, False
+    node_id = _bucketed_node_id(node_id)
     call_id, asof = node_id.to_call_id_and_asof()
     if not cache.contains(node_id):
-        with MemoizerContext(cache=cache, asof=asof):
+        with MemoizerContext(cache=cache, asof=asof, max_staleness=max_staleness):
             f, args, kwargs = call_id.to_call()
-            f(*args, **kwargs)
\ No newline at end of file
+            f(*args, **kwargs)
+        if max_staleness is not None and not cache.contains(node_id):
+            stale_node_id = _latest_earlier_node_id(cache, call_id, asof, max_staleness)
+            if stale_node_id is not None:
+                return stale_node_id, True
+            # computed from stale children, but there is no earlier result of its own to serve
+            with _ExactContext(current_context()._replace(cache=cache, asof=asof, max_staleness=None)):
+                f(*args, **kwargs)
+    return node_id, False
\ No newline at end of file